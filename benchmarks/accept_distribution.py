@@ -0,0 +1,141 @@
+"""
+Compare accept latency and distribution of connections between worker
+processes of FastCGIServer sharing one listening socket, listening on
+their own SO_REUSEPORT sockets and receiving connections accepted by master
+process.
+
+Every connection carries single request. Request handler spins for
+--work-ms milliseconds and replies with PID of the worker so connections
+can be counted per worker. Latency is measured from connect() to first
+response record, i.e. it includes time connection spent in accept queue.
+
+    $ python benchmarks/accept_distribution.py --workers 8 --connections 5000
+"""
+from __future__ import absolute_import, print_function, division
+
+import os
+import sys
+import time
+import argparse
+import multiprocessing
+import logging
+from collections import Counter
+
+from gevent import socket, joinall, sleep
+from gevent.pool import Pool
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from gevent_fastcgi.const import (
+    FCGI_BEGIN_REQUEST,
+    FCGI_END_REQUEST,
+    FCGI_PARAMS,
+    FCGI_RESPONDER,
+    FCGI_STDIN,
+    FCGI_STDOUT,
+)
+from gevent_fastcgi.base import Connection, Record
+from gevent_fastcgi.server import FastCGIServer
+from gevent_fastcgi.utils import pack_begin_request, pack_pairs
+
+
+def request_handler(work):
+    def handler(request):
+        deadline = time.time() + work
+        while time.time() < deadline:
+            pass
+        request.stdout.write(str(os.getpid()).encode('ascii'))
+    return handler
+
+
+def make_request(address):
+    start = time.time()
+    sock = socket.create_connection(address)
+    try:
+        conn = Connection(sock)
+        conn.write_records([
+            Record(FCGI_BEGIN_REQUEST,
+                   pack_begin_request(FCGI_RESPONDER, 0), 1),
+            Record(FCGI_PARAMS, pack_pairs({'REQUEST_METHOD': 'GET'}), 1),
+            Record(FCGI_PARAMS, b'', 1),
+            Record(FCGI_STDIN, b'', 1),
+        ])
+        latency = None
+        pid = b''
+        for record in conn:
+            if latency is None:
+                latency = time.time() - start
+            if record.type == FCGI_STDOUT:
+                pid += bytes(record.content)
+            elif record.type == FCGI_END_REQUEST:
+                break
+        return latency, int(pid)
+    finally:
+        sock.close()
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+MODES = ('shared', 'reuse_port', 'master_accept')
+
+
+def run(mode, options):
+    server = FastCGIServer(
+        ('127.0.0.1', 0), request_handler(options.work_ms / 1000),
+        num_workers=options.workers, backlog=options.backlog,
+        reuse_port=mode == 'reuse_port',
+        master_accept=mode == 'master_accept')
+    server.start()
+    try:
+        # let workers start listening
+        sleep(0.5)
+        pool = Pool(options.concurrency)
+        jobs = [pool.spawn(make_request, server.address)
+                for _ in range(options.connections)]
+        joinall(jobs)
+    finally:
+        server.stop()
+
+    results = [job.value for job in jobs if job.successful()]
+    latencies = sorted(latency for latency, _ in results)
+    per_worker = Counter(pid for _, pid in results)
+    counts = sorted(per_worker.values(), reverse=True)
+    counts.extend([0] * (options.workers - len(counts)))
+    mean = sum(counts) / len(counts)
+    stdev = (sum((count - mean) ** 2 for count in counts) / len(counts)) ** .5
+
+    print('{0}:'.format(mode))
+    print('  failed connections: {0}'.format(len(jobs) - len(results)))
+    if latencies:
+        print('  latency ms: p50 {0:.2f} p90 {1:.2f} p99 {2:.2f} '
+              'max {3:.2f}'.format(*(
+                  1000 * percentile(latencies, fraction)
+                  for fraction in (.5, .9, .99, 1))))
+    print('  connections per worker: {0}'.format(
+        ' '.join(map(str, counts))))
+    print('  max/mean {0:.2f} stdev/mean {1:.2f}'.format(
+        counts[0] / mean if mean else 0, stdev / mean if mean else 0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--workers', type=int,
+                        default=multiprocessing.cpu_count())
+    parser.add_argument('--connections', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--work-ms', type=float, default=1)
+    parser.add_argument('--backlog', type=int, default=1024)
+    parser.add_argument('--mode', choices=MODES + ('all',), default='all')
+    options = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    for mode in MODES:
+        if options.mode in (mode, 'all'):
+            run(mode, options)
+
+
+if __name__ == '__main__':
+    main()
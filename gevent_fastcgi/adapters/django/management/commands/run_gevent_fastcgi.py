@@ -41,6 +41,86 @@ class Command(BaseCommand):
                     metavar='NUM_WORKERS',
                     help='Number of worker processes (default %default)',
                     ),
+        make_option('--reuse-port', action='store_true', dest='reuse_port',
+                    default=False,
+                    help='Let every worker process listen on its own socket '
+                    'bound with SO_REUSEPORT (TCP only)'),
+        make_option('--master-accept', action='store_true',
+                    dest='master_accept', default=False,
+                    help='Accept connections in master process and pass '
+                    'them to worker with least active requests'),
+        make_option('--preload', action='store_true', dest='preload',
+                    default=False,
+                    help='Import URLconf and views and freeze objects of '
+                    'loaded application before forking workers to keep '
+                    'memory shared with them'),
+        make_option('--max-requests', type='int', dest='max_requests',
+                    metavar='MAX_REQUESTS',
+                    help='Recycle worker after it has handled MAX_REQUESTS '
+                    'requests'),
+        make_option('--max-requests-jitter', type='int',
+                    dest='max_requests_jitter', default=0,
+                    metavar='MAX_REQUESTS_JITTER',
+                    help='Add random number up to MAX_REQUESTS_JITTER to '
+                    'MAX_REQUESTS of every worker (default %default)'),
+        make_option('--max-rss', type='int', dest='max_rss',
+                    metavar='MAX_RSS',
+                    help='Recycle worker once its RSS is over MAX_RSS bytes'),
+        make_option('--max-age', type='int', dest='max_age',
+                    metavar='MAX_AGE',
+                    help='Recycle worker after MAX_AGE seconds'),
+        make_option('--drain-timeout', type='int', dest='drain_timeout',
+                    default=30, metavar='DRAIN_TIMEOUT',
+                    help='Give retiring worker up to DRAIN_TIMEOUT seconds '
+                    'to complete active requests (default %default)'),
+        make_option('--write-queue-size', type='int',
+                    dest='write_queue_size', metavar='WRITE_QUEUE_SIZE',
+                    help='Queue response records and send them from single '
+                    'greenlet blocking writers once WRITE_QUEUE_SIZE bytes '
+                    'are queued',
+                    ),
+        make_option('--stdout-buffer-size', type='int',
+                    dest='stdout_buffer_size', metavar='STDOUT_BUFFER_SIZE',
+                    help='Collect response output into records of up to '
+                    'STDOUT_BUFFER_SIZE bytes instead of sending every chunk '
+                    'separately',
+                    ),
+        make_option('--stdin-max-mem', type='int', dest='stdin_max_mem',
+                    default=1024, metavar='STDIN_MAX_MEM',
+                    help='Keep up to STDIN_MAX_MEM bytes of request body in '
+                    'memory (default %default)',
+                    ),
+        make_option('--stdin-spool-dir', dest='stdin_spool_dir',
+                    metavar='STDIN_SPOOL_DIR',
+                    help='Spool larger request bodies to STDIN_SPOOL_DIR '
+                    'instead of anonymous memory files',
+                    ),
+        make_option('--stdin-offload', action='store_true',
+                    dest='stdin_offload', default=False,
+                    help='Spool request bodies from thread pool'),
+        make_option('--stdin-memory-budget', type='int',
+                    dest='stdin_memory_budget',
+                    metavar='STDIN_MEMORY_BUDGET',
+                    help='Keep at most STDIN_MEMORY_BUDGET bytes of request '
+                    'bodies in memory per worker process, largest ones are '
+                    'spooled to files once it is exceeded',
+                    ),
+        make_option('--stdin-streaming', action='store_true',
+                    dest='stdin_streaming', default=False,
+                    help='Let application read request body while it is '
+                    'still being received'),
+        make_option('--stdin-high-water-mark', type='int',
+                    dest='stdin_high_water_mark',
+                    metavar='STDIN_HIGH_WATER_MARK',
+                    help='Stop reading from connection while request has '
+                    'more than STDIN_HIGH_WATER_MARK bytes of unread body '
+                    '(requires --stdin-streaming)',
+                    ),
+        make_option('--max-body-size', type='int', dest='max_body_size',
+                    metavar='MAX_BODY_SIZE',
+                    help='Respond with 413 status to requests with body '
+                    'larger than MAX_BODY_SIZE bytes',
+                    ),
         make_option('--monkey-patch', dest='monkey_patch',
                     help='Comma separated list of function names from '
                     'gevent.monkey module. Allowed names are: ' + ', '.join(
@@ -114,9 +194,30 @@ class Command(BaseCommand):
 
         kwargs = dict((
             (name, value) for name, value in options.iteritems() if name in (
-                'num_workers', 'max_conns', 'buffer_size', 'socket_mode')))
+                'num_workers', 'max_conns', 'buffer_size', 'socket_mode',
+                'write_queue_size', 'stdout_buffer_size', 'stdin_max_mem',
+                'stdin_spool_dir', 'stdin_offload',
+                'stdin_memory_budget', 'stdin_streaming',
+                'stdin_high_water_mark', 'max_body_size', 'reuse_port',
+                'master_accept', 'preload', 'max_requests',
+                'max_requests_jitter', 'max_rss', 'max_age',
+                'drain_timeout')))
 
         app = WSGIHandler()
+        if kwargs.get('preload'):
+            kwargs['preload'] = warm_up
         request_handler = WSGIRequestHandler(app)
         server = FastCGIServer(bind_address, request_handler, **kwargs)
         server.serve_forever()
+
+
+def warm_up():
+    """
+    Import URLconf and views it refers to, which Django does on first
+    request otherwise, so that they are shared with worker processes
+    """
+    try:
+        from django.urls import get_resolver
+    except ImportError:
+        from django.core.urlresolvers import get_resolver
+    get_resolver(None).reverse_dict
@@ -32,8 +32,15 @@ def server_params(app, conf, host='127.0.0.1', port=5000, socket=None,
     address = (host, int(port)) if socket is None else socket
     for name in kwargs.keys():
         if name in ('max_conns', 'num_workers', 'buffer_size', 'backlog',
-                    'socket_mode'):
+                    'socket_mode', 'write_queue_size',
+                    'stdout_buffer_size', 'stdin_max_mem',
+                    'stdin_memory_budget', 'stdin_high_water_mark',
+                    'max_body_size', 'max_requests', 'max_requests_jitter',
+                    'max_rss', 'max_age', 'drain_timeout'):
             kwargs[name] = int(kwargs[name])
+        elif name in ('stdin_offload', 'stdin_streaming', 'reuse_port',
+                      'master_accept', 'preload'):
+            kwargs[name] = asbool(kwargs[name])
         elif name.startswith('gevent.monkey.') and asbool(kwargs.pop(name)):
             name = name[14:]
             if name in gevent.monkey.__all__:
@@ -20,15 +20,19 @@
 
 from __future__ import with_statement
 
+import os
 import six
 import sys
+import errno
 import logging
-from collections import namedtuple
-from tempfile import SpooledTemporaryFile
+from collections import namedtuple, deque
+from io import BytesIO
+from tempfile import TemporaryFile
 
 from zope.interface import implementer
-from gevent import socket
+from gevent import socket, spawn_later, get_hub
 from gevent.event import Event
+from gevent.lock import Semaphore
 
 from .interfaces import IConnection
 from .const import (
@@ -42,17 +46,27 @@ from .const import (
     FCGI_RECORD_TYPES,
     FCGI_MAX_CONTENT_LEN,
 )
-from .utils import pack_header, unpack_header
+from .utils import pack_header, unpack_header, parse_records
 
 if sys.version_info > (3,):
     buffer = memoryview
 
+try:
+    IOV_MAX = os.sysconf('SC_IOV_MAX')
+except (AttributeError, ValueError, OSError):
+    IOV_MAX = 16
+
+PADDING = tuple(b'\x00' * size for size in range(8))
+
 
 __all__ = (
     'PartialRead',
+    'BodyTooLarge',
     'BufferedReader',
     'Record',
     'Connection',
+    'MemoryBudget',
+    'SpooledFile',
     'InputStream',
     'StdoutStream',
     'StderrStream',
@@ -73,85 +87,208 @@ class PartialRead(Exception):
         self.partial_data = partial_data
 
 
-class BufferedReader(object):
-    """ Allows to receive data in large chunks
+class BodyTooLarge(IOError):
+    """ Raised by InputStream reads once request body turns out to be
+    larger than allowed
     """
-    def __init__(self, read_callable, buffer_size):
-        self._reader = self._reader_generator(read_callable, buffer_size)
-        next(self._reader)  # advance generator to first yield statement
 
-    def read_bytes(self, max_len):
-        return self._reader.send(max_len)
 
-    @staticmethod
-    def _reader_generator(read, buf_size):
-        buf = b''
-        blen = 0
-        chunks = []
-        size = (yield)
-
-        while True:
-            if blen >= size:
-                data, buf = buf[:size], buf[size:]
-                blen -= size
-            else:
-                while blen < size:
-                    chunks.append(buf)
-                    buf = read(
-                        (size - blen + buf_size - 1) // buf_size * buf_size)
-                    if not buf:
-                        raise PartialRead(size, b''.join(chunks))
-                    blen += len(buf)
-
-                blen -= size
-
-                if blen:
-                    chunks.append(buf[:-blen])
-                    buf = buf[-blen:]
-                else:
-                    chunks.append(buf)
-                    buf = b''
+class BufferedReader(object):
+    """ Receives data into preallocated buffer and hands out memoryview
+    slices of it. Unread data is moved to a new buffer once there is no room
+    left for requested length so slices handed out earlier stay intact
+    """
+    def __init__(self, recv_into, buffer_size):
+        self._recv_into = recv_into
+        self._buffer_size = buffer_size
+        self._view = memoryview(bytearray(buffer_size))
+        self._start = 0
+        self._end = 0
+
+    def read_bytes(self, size):
+        start = self._start
+        if self._end - start < size:
+            self._fill(size)
+            start = self._start
+        self._start = start + size
+        return self._view[start:start + size]
+
+    def _fill(self, size):
+        view = self._view
+        start, end = self._start, self._end
+
+        if start + size > len(view):
+            # buffer wrapped, compact unread data into a fresh one
+            available = end - start
+            buf = bytearray(max(size, self._buffer_size))
+            buf[:available] = view[start:end]
+            view = self._view = memoryview(buf)
+            start, end = 0, available
+            self._start = 0
+
+        recv_into = self._recv_into
+        while end - start < size:
+            received = recv_into(view[end:])
+            if not received:
+                self._end = end
+                raise PartialRead(size, view[start:end].tobytes())
+            end += received
+        self._end = end
 
-                data = b''.join(chunks)
-                chunks = []
+    @property
+    def buffered(self):
+        return self._end - self._start
 
-            size = (yield data)
+    def parse(self, parser):
+        """ Consume buffered data with parser(view, start, end) returning
+        result and position of the first byte left unparsed
+        """
+        result, self._start = parser(self._view, self._start, self._end)
+        return result
 
 
 class Record(namedtuple('Record', ('type', 'content', 'request_id'))):
+    """ Content is bytes-like object or, for outgoing records only, list of
+    them that are sent one after another
+    """
+
+    __slots__ = ()
 
     def __str__(self):
         return '<Record {0}, req id {1}, {2} bytes>'.format(
             FCGI_RECORD_TYPES.get(self.type, self.type),
             self.request_id,
-            len(self.content))
+            self.content_len)
+
+    @property
+    def content_len(self):
+        content = self.content
+        if isinstance(content, list):
+            return sum(len(buf) for buf in content)
+        return len(content)
 
 
 @implementer(IConnection)
 class Connection(object):
     def __init__(self, sock, buffer_size=4096):
         self._sock = sock
-        self.buffered_reader = BufferedReader(sock.recv, buffer_size)
+        self.buffered_reader = BufferedReader(sock.recv_into, buffer_size)
+        # records parsed but not handed out by iterator yet
+        self._parsed = deque()
+
+    def write_record(self, record, request_id=None, content=b''):
+        """
+        Send single record. Record type, request ID and content can be
+        passed instead of Record instance to save creating one
+        """
+        if request_id is None:
+            record_type, content, request_id = record
+        else:
+            record_type = record
+        buffers = []
+        self._add_record_buffers(buffers, record_type, request_id, content)
+        self._send_buffers(buffers)
+
+    def write_records(self, records):
+        """
+        Serialize records and send them with as few system calls as possible
+        """
+        buffers = []
+        add_record_buffers = self._add_record_buffers
+        for record_type, content, request_id in records:
+            add_record_buffers(buffers, record_type, request_id, content)
+
+        if buffers:
+            self._send_buffers(buffers)
 
-    def write_record(self, record):
-        send = self._sock.send
-        content_len = len(record.content)
+    @staticmethod
+    def _add_record_buffers(buffers, record_type, request_id, content):
+        if isinstance(content, six.text_type):
+            content = content.encode("ISO-8859-1")
+        if isinstance(content, list):
+            content_len = sum(len(buf) for buf in content)
+        else:
+            content_len = len(content)
         if content_len > FCGI_MAX_CONTENT_LEN:
             raise ValueError('Record content length exceeds {0}'.format(
                 FCGI_MAX_CONTENT_LEN))
+        # spec recommends to keep records 8-byte aligned
+        padding = -content_len & 7
+        buffers.append(pack_header(
+            FCGI_VERSION, record_type, request_id, content_len, padding))
+        if isinstance(content, list):
+            buffers.extend(content)
+        elif content_len:
+            buffers.append(content)
+        if padding:
+            buffers.append(PADDING[padding])
+
+    def send_file(self, record_type, request_id, fd, offset, count):
+        """
+        Send file content as records. Only headers are sent from userspace
+        while content goes with os.sendfile where supported
+        """
+        try:
+            sock_fd = self._sock.fileno()
+        except AttributeError:
+            sock_fd = None
+        if sock_fd is None or not hasattr(os, 'sendfile'):
+            return self._send_file_contents(
+                record_type, request_id, fd, offset, count)
+
+        while count:
+            size = min(count, FCGI_MAX_CONTENT_LEN)
+            # no padding so that every record takes two system calls only
+            self._send_buffers([pack_header(
+                FCGI_VERSION, record_type, request_id, size, 0)])
+            end = offset + size
+            while offset < end:
+                try:
+                    sent = os.sendfile(sock_fd, fd, offset, end - offset)
+                except OSError as e:
+                    if e.errno != errno.EAGAIN:
+                        raise
+                    socket.wait_write(sock_fd)
+                    continue
+                if not sent:
+                    raise IOError('Unexpected end of file')
+                offset += sent
+            count -= size
+
+    def _send_file_contents(self, record_type, request_id, fd, offset,
+                            count):
+        os.lseek(fd, offset, os.SEEK_SET)
+        while count:
+            data = os.read(fd, min(count, FCGI_MAX_CONTENT_LEN))
+            if not data:
+                raise IOError('Unexpected end of file')
+            # bypass locking of subclasses, caller holds it already
+            Connection.write_record(self, record_type, request_id, data)
+            count -= len(data)
+
+    def _send_buffers(self, buffers):
+        sendmsg = getattr(self._sock, 'sendmsg', None)
+        if sendmsg is None:
+            data = buffer(b''.join(buffers))
+            send = self._sock.send
+            sent, size = 0, len(data)
+            while sent < size:
+                sent += send(data[sent:])
+            return
 
-        header = pack_header(
-            FCGI_VERSION, record.type, record.request_id, content_len, 0)
-
-        for buf, length in (
-            (header, FCGI_RECORD_HEADER_LEN),
-            (record.content, content_len),
-        ):
-            if isinstance(buf, six.text_type):
-                buf = buf.encode("ISO-8859-1")
-            sent = 0
-            while sent < length:
-                sent += send(buffer(buf[sent:]))
+        while buffers:
+            sent = sendmsg(buffers[:IOV_MAX])
+            # skip buffers that were sent completely
+            for i, buf in enumerate(buffers):
+                size = len(buf)
+                if sent < size:
+                    if sent:
+                        buffers[i] = memoryview(buf)[sent:]
+                    del buffers[:i]
+                    break
+                sent -= size
+            else:
+                break
 
     def read_record(self):
         read_bytes = self.buffered_reader.read_bytes
@@ -165,10 +302,6 @@ class Connection(object):
             # Remote side closed connection after sending all records
             logger.debug('Connection closed by peer')
             return None
-        except StopIteration:
-            # Connection closed unexpectedly
-            logger.debug('Connection closed by peer')
-            return None
 
         version, record_type, request_id, content_len, padding = (
             unpack_header(header))
@@ -176,18 +309,40 @@ class Connection(object):
         if content_len:
             content = read_bytes(content_len)
         else:
-            content = ''
+            content = b''
 
-        if padding:  # pragma: no cover
+        if padding:
             read_bytes(padding)
 
-        if isinstance(content, six.text_type):
-            content = content.encode("ISO-8859-1")
-
         return Record(record_type, content, request_id)
 
     def __iter__(self):
-        return iter(self.read_record, None)
+        parse = self.buffered_reader.parse
+        read_record = self.read_record
+        parsed = self._parsed
+        while True:
+            if not parsed:
+                # all records that were received completely are parsed at
+                # once
+                parsed.extend(parse(self._parse_records))
+                if not parsed:
+                    # wait for next record to arrive
+                    record = read_record()
+                    if record is None:
+                        return
+                    parsed.append(record)
+            yield parsed.popleft()
+
+    def received(self):
+        """
+        Return True if there is data received from peer that has not been
+        handed out as records yet
+        """
+        return bool(self._parsed) or self.buffered_reader.buffered > 0
+
+    @staticmethod
+    def _parse_records(data, start, end):
+        return parse_records(data, start, end, Record)
 
     def close(self):
         if self._sock:
@@ -197,56 +352,371 @@ class Connection(object):
     def done_writing(self):
         self._sock.shutdown(socket.SHUT_WR)
 
+    def done_reading(self):
+        self._sock.shutdown(socket.SHUT_RD)
+
+
+class MemoryBudget(object):
+    """
+    Keeps track of data buffered in memory by SpooledFile instances that
+    share it. Once usage exceeds limit, largest of them are moved to files
+    until it fits again.
+    """
+    def __init__(self, limit):
+        self.limit = limit
+        self.usage = 0
+        self._sizes = {}
+
+    def allocate(self, owner, size):
+        self._sizes[owner] = self._sizes.get(owner, 0) + size
+        self.usage += size
+        if self.usage > self.limit:
+            sizes = self._sizes
+            for owner in sorted(sizes, key=sizes.get, reverse=True):
+                if self.usage <= self.limit:
+                    break
+                # releases memory owned by it
+                owner.rollover()
+
+    def release(self, owner):
+        self.usage -= self._sizes.pop(owner, 0)
+
+
+class SpooledFile(object):
+    """
+    Keeps data in memory until more than max_mem bytes have been written.
+    Then moves it to anonymous memfd file or, if spool_dir is specified or
+    memfd is not supported, to temporary file in spool_dir.
+    If offload is set, file operations are done in gevent threadpool so that
+    slow disk does not block the whole process.
+    If budget is specified, memory is accounted there and data is always
+    moved to temporary file since memfd counts as memory too.
+    Written data is appended to the end of file while reading position is
+    kept, so it can be read before all data has been written.
+    """
+
+    __slots__ = ('_file', '_max_mem', '_spool_dir', '_budget', '_rolled',
+                 '_size', '_lock')
+
+    def __init__(self, max_mem=1024, spool_dir=None, offload=False,
+                 budget=None):
+        self._file = BytesIO()
+        self._max_mem = max_mem
+        self._spool_dir = spool_dir
+        self._budget = budget
+        self._rolled = False
+        self._size = 0
+        # file must not be touched while offloaded call is in progress
+        self._lock = Semaphore() if offload else None
+
+    def write(self, data):
+        rolled = self._rolled
+        if self._lock is None:
+            self._write(data)
+        else:
+            with self._lock:
+                if self._rolled or self._size + len(data) > self._max_mem:
+                    get_hub().threadpool.apply(self._write, (data,))
+                else:
+                    self._write(data)
+        # budget is shared by files of all requests and must only be
+        # updated in hub thread
+        if self._budget is not None and not rolled:
+            if self._rolled:
+                self._budget.release(self)
+            else:
+                self._budget.allocate(self, len(data))
+
+    def _write(self, data):
+        size = len(data)
+        if self._rolled or self._size + size <= self._max_mem:
+            file = self._file
+            position = file.tell()
+            if position != self._size:
+                file.seek(self._size)
+            file.write(data)
+            file.seek(position)
+        else:
+            self._rollover(data)
+        self._size += size
+
+    def rollover(self):
+        if self._rolled or self._file.closed:
+            return
+        if self._lock is None:
+            self._rollover()
+        elif self._lock.locked():
+            # offloaded call in progress takes care of it
+            return
+        else:
+            with self._lock:
+                if not (self._rolled or self._file.closed):
+                    get_hub().threadpool.apply(self._rollover)
+        if self._budget is not None:
+            self._budget.release(self)
+
+    def _rollover(self, data=b''):
+        if (self._spool_dir is None and self._budget is None
+                and hasattr(os, 'memfd_create')):
+            spool = os.fdopen(os.memfd_create(
+                'gevent-fastcgi-input', os.MFD_CLOEXEC), 'w+b')
+        else:
+            spool = TemporaryFile(dir=self._spool_dir)
+        position = self._file.tell()
+        spool.write(self._file.getvalue())
+        if data:
+            spool.write(data)
+        spool.seek(position)
+        self._file.close()
+        self._file = spool
+        self._rolled = True
+
+    def _call(self, name, *args):
+        if self._lock is None:
+            return getattr(self._file, name)(*args)
+        with self._lock:
+            method = getattr(self._file, name)
+            if self._rolled:
+                return get_hub().threadpool.apply(method, args)
+            return method(*args)
+
+    @property
+    def rolled(self):
+        return self._rolled
+
+    @property
+    def size(self):
+        return self._size
+
+    def seek(self, offset, whence=0):
+        return self._call('seek', offset, whence)
+
+    def tell(self):
+        # offloaded write moves position while appending data
+        return self._call('tell')
+
+    def read(self, size=-1):
+        return self._call('read', size)
+
+    def readinto(self, buf):
+        return self._call('readinto', buf)
+
+    def readline(self, size=-1):
+        return self._call('readline', size)
+
+    def readlines(self, sizehint=0):
+        return self._call('readlines', sizehint)
+
+    def __iter__(self):
+        return iter(self.readline, b'')
+
+    def close(self):
+        self._file.close()
+        if self._budget is not None:
+            self._budget.release(self)
+
 
 class InputStream(object):
     """
     FCGI_STDIN or FCGI_DATA stream.
-    Uses temporary file to store received data once max_mem bytes
-    have been received.
+    Uses SpooledFile to store received data, see it for meaning of
+    max_mem, spool_dir, offload and budget arguments.
+    Reading blocks until all data has been received unless streaming is set.
+    In streaming mode reads return as soon as enough data has been received
+    and block only when it's not enough and EOF has not been received yet.
+    Also in streaming mode wait_drained blocks feeder while there are more
+    than high_water_mark bytes of unread data until reader consumes half of
+    it.
+    Once discarded, stream drops data received so far and ignores the rest
+    of it except for EOF mark.
+    If pump is set, it is called to receive more data while reader waits
+    for it, until it returns False.
+    Stream must be closed once it is not needed anymore to release
+    buffered data.
     """
-    def __init__(self, max_mem=1024):
-        self._file = SpooledTemporaryFile(max_mem)
-        self._eof_received = Event()
 
-    def __del__(self):
-        self._file.close()
+    __slots__ = ('_file', '_eof_received', '_complete', '_error',
+                 '_streaming', '_fed', '_high_water_mark', '_drained',
+                 '_discarded', 'pump')
+
+    def __init__(self, max_mem=1024, spool_dir=None, offload=False,
+                 budget=None, streaming=False, high_water_mark=None):
+        self._file = SpooledFile(max_mem, spool_dir, offload, budget)
+        self._eof_received = Event()
+        # set on EOF or once reads are going to fail
+        self._complete = Event()
+        self._error = None
+        self._streaming = streaming
+        self._fed = Event()
+        self._high_water_mark = high_water_mark if streaming else None
+        self._drained = Event()
+        self._drained.set()
+        self._discarded = False
+        self.pump = None
 
     def feed(self, data):
         if self._eof_received.is_set():
             raise IOError('Feeding file beyond EOF mark')
         if not data:  # EOF mark
-            self._file.seek(0)
             self._eof_received.set()
+            self._complete.set()
+        elif self._discarded:
+            return
         else:
             if isinstance(data, six.text_type):
                 data = data.encode("ISO-8859-1")
             self._file.write(data)
+        self._fed.set()
+
+    def wait_drained(self):
+        high_water_mark = self._high_water_mark
+        if high_water_mark is not None and self.unread > high_water_mark:
+            self._drained.clear()
+            self._drained.wait()
+
+    def resume(self):
+        """
+        Stop blocking feeder, e.g. when reader needs all the data at once or
+        is not going to read anymore
+        """
+        self._high_water_mark = None
+        self._drained.set()
+
+    def discard(self, error=None):
+        """
+        Drop data received so far and ignore the rest of it, e.g. when
+        request has been handled without reading its body. If error is
+        specified it is raised by subsequent reads
+        """
+        if not self._discarded:
+            self._discarded = True
+            self.resume()
+            self._file.close()
+            self._file = SpooledFile()
+        if error is not None:
+            self._error = error
+            self._complete.set()
+        self._fed.set()
+
+    def close(self):
+        """
+        Release buffered data and pump. Subsequent reads fail
+        """
+        self.discard(ValueError('I/O operation on closed stream'))
+        self.pump = None
+
+    @property
+    def discarded(self):
+        return self._discarded
+
+    def _consumed(self):
+        if (not self._drained.is_set()
+                and self.unread <= self._high_water_mark // 2):
+            self._drained.set()
+
+    def _wait(self, event):
+        pump = self.pump
+        while pump is not None and not event.is_set() and pump():
+            pass
+        event.wait()
+
+    def _wait_eof(self):
+        self._wait(self._complete)
+        if self._error is not None:
+            raise self._error
+
+    def _wait_data(self):
+        if self._error is None:
+            self._wait(self._fed)
+        if self._error is not None:
+            raise self._error
 
     def __iter__(self):
-        self._eof_received.wait()
+        if self._streaming:
+            return iter(self.readline, b'')
+        self._wait_eof()
         return iter(self._file)
 
     def read(self, size=-1):
-        self._eof_received.wait()
-        return self._file.read(size)
+        if size is None or size < 0 or not self._streaming:
+            self.resume()
+            self._wait_eof()
+            return self._file.read(size)
+        chunks = []
+        while True:
+            # cleared before reading to not miss data fed meanwhile
+            self._fed.clear()
+            eof = self._eof_received.is_set()
+            chunk = self._file.read(size)
+            self._consumed()
+            chunks.append(chunk)
+            size -= len(chunk)
+            if not size or eof:
+                return b''.join(chunks)
+            self._wait_data()
+
+    def readinto(self, buf):
+        if not self._streaming:
+            self._wait_eof()
+            return self._file.readinto(buf)
+        while True:
+            self._fed.clear()
+            eof = self._eof_received.is_set()
+            size = self._file.readinto(buf)
+            self._consumed()
+            if size or eof or not len(buf):
+                return size
+            self._wait_data()
 
     def readline(self, size=-1):
-        self._eof_received.wait()
-        return self._file.readline(size)
+        if size is None:
+            size = -1
+        if not self._streaming:
+            self._wait_eof()
+            return self._file.readline(size)
+        chunks = []
+        while True:
+            self._fed.clear()
+            eof = self._eof_received.is_set()
+            line = self._file.readline(size)
+            self._consumed()
+            chunks.append(line)
+            size -= len(line)
+            if line.endswith(b'\n') or not size or eof:
+                return b''.join(chunks)
+            self._wait_data()
 
     def readlines(self, sizehint=0):
-        self._eof_received.wait()
+        self.resume()
+        self._wait_eof()
         return self._file.readlines(sizehint)
 
     @property
     def eof_received(self):
         return self._eof_received.is_set()
 
+    @property
+    def size(self):
+        """
+        Number of bytes received and kept so far
+        """
+        return self._file.size
+
+    @property
+    def unread(self):
+        """
+        Number of bytes received but not read yet
+        """
+        return self._file.size - self._file.tell()
+
 
 class OutputStream(object):
     """
     FCGI_STDOUT or FCGI_STDERR stream.
     """
+
+    __slots__ = ('conn', 'request_id', 'closed')
+
     def __init__(self, conn, request_id):
         self.conn = conn
         self.request_id = request_id
@@ -265,26 +735,32 @@ class OutputStream(object):
         size = len(data)
 
         if size <= FCGI_MAX_CONTENT_LEN:
-            record = Record(record_type, data, request_id)
-            write_record(record)
+            write_record(record_type, request_id, data)
         else:
             data = buffer(data)
             sent = 0
             while sent < size:
-                record = Record(record_type,
-                                data[sent:sent + FCGI_MAX_CONTENT_LEN],
-                                request_id)
-                write_record(record)
+                write_record(record_type, request_id,
+                             data[sent:sent + FCGI_MAX_CONTENT_LEN])
                 sent += FCGI_MAX_CONTENT_LEN
 
     def writelines(self, lines):
         if self.closed:
             raise IOError('Writing to closed stream {0}'.format(self))
 
-        write_record = self.conn.write_record
+        records = self._records(lines)
+        if records:
+            self.conn.write_records(records)
+
+    def _records(self, lines):
+        """
+        Pack lines into records. Lines are split with memoryview slices and
+        small ones are gathered into the same record rather than joined
+        """
         record_type = self.record_type
         request_id = self.request_id
-        buf = []
+        records = []
+        buffers = []
         remainder = FCGI_MAX_CONTENT_LEN
 
         for line in lines:
@@ -292,55 +768,181 @@ class OutputStream(object):
                 # skip empty lines
                 continue
 
-            line_len = len(line)
             if isinstance(line, six.text_type):
                 line = line.encode("ISO-8859-1")
-
-            if line_len >= remainder:
-                buf.append(line[:remainder])
-                record = Record(record_type, b''.join(buf), request_id)
-                write_record(record)
-                buf = [line[remainder:]]
-                remainder = FCGI_MAX_CONTENT_LEN
+            elif isinstance(line, memoryview) and line.itemsize != 1:
+                line = line.cast('B')
+
+            size = len(line)
+            if size >= remainder:
+                line = buffer(line)
+                pos = 0
+                while size - pos >= remainder:
+                    buffers.append(line[pos:pos + remainder])
+                    records.append(Record(record_type, buffers, request_id))
+                    pos += remainder
+                    buffers = []
+                    remainder = FCGI_MAX_CONTENT_LEN
+                if pos < size:
+                    buffers.append(line[pos:])
+                    remainder -= size - pos
             else:
-                buf.append(line)
-                remainder -= line_len
+                buffers.append(line)
+                remainder -= size
 
-        if buf:
-            record = Record(record_type, b''.join(buf), request_id)
-            write_record(record)
+        if buffers:
+            records.append(Record(record_type, buffers, request_id))
+        return records
 
     def flush(self):
         pass
 
+    def send_file(self, fd, offset, count):
+        """
+        Send count bytes of file descriptor fd starting at offset
+        """
+        if self.closed:
+            raise IOError('Writing to closed stream {0}'.format(self))
+        self.flush()
+        if count:
+            self.conn.send_file(
+                self.record_type, self.request_id, fd, offset, count)
+
     def close(self):
-        if not self.closed:
-            self.closed = True
-            self.conn.write_record(
-                Record(self.record_type, b'', self.request_id))
+        records = self.close_records()
+        if records:
+            self.conn.write_records(records)
+
+    def close_records(self, data=b''):
+        """
+        Mark stream as closed and return records carrying data followed by
+        EOF mark. It's up to caller to send them
+        """
+        if self.closed:
+            if data:
+                raise IOError('Writing to closed stream {0}'.format(self))
+            return []
+
+        self.closed = True
+        record_type = self.record_type
+        request_id = self.request_id
+        if isinstance(data, six.text_type):
+            data = data.encode("ISO-8859-1")
+        data = buffer(data)
+        records = [
+            Record(record_type, data[pos:pos + FCGI_MAX_CONTENT_LEN],
+                   request_id)
+            for pos in range(0, len(data), FCGI_MAX_CONTENT_LEN)]
+        records.append(Record(record_type, b'', request_id))
+        return records
 
 
 class StdoutStream(OutputStream):
+    """
+    FCGI_STDOUT stream.
+    If buffer_size is set output is collected into records of up to
+    buffer_size bytes that are sent once buffer is full, on flush or close
+    or flush_delay seconds after first chunk was buffered.
+    """
+
+    __slots__ = ('buffer_size', '_flush_delay', '_buffer', '_flusher')
 
     record_type = FCGI_STDOUT
+    flush_delay = 0.01
+
+    def __init__(self, conn, request_id, buffer_size=None, flush_delay=None):
+        super(StdoutStream, self).__init__(conn, request_id)
+        if buffer_size is not None and not (
+                0 < buffer_size <= FCGI_MAX_CONTENT_LEN):
+            raise ValueError('Buffer size must be between 1 and {0}'.format(
+                FCGI_MAX_CONTENT_LEN))
+        self.buffer_size = buffer_size
+        if flush_delay is None:
+            flush_delay = self.flush_delay
+        self._flush_delay = flush_delay
+        self._buffer = bytearray()
+        self._flusher = None
+
+    def write(self, data):
+        if not self.buffer_size:
+            return OutputStream.write(self, data)
+
+        if self.closed:
+            raise IOError('Writing to closed stream {0}'.format(self))
+
+        if not data:
+            return
+
+        if isinstance(data, six.text_type):
+            data = data.encode("ISO-8859-1")
+
+        size = len(data)
+        if len(self._buffer) + size > self.buffer_size:
+            self.flush()
+
+        if size >= self.buffer_size:
+            OutputStream.write(self, data)
+        else:
+            self._buffer += data
+            if len(self._buffer) >= self.buffer_size:
+                self.flush()
+            elif self._flusher is None:
+                self._flusher = spawn_later(
+                    self._flush_delay, self._delayed_flush)
 
     def writelines(self, lines):
+        if self.buffer_size:
+            if self.closed:
+                raise IOError('Writing to closed stream {0}'.format(self))
+            for line in lines:
+                self.write(line)
         # WSGI server must not buffer application iterable
-        if isinstance(lines, (list, tuple)):
+        elif isinstance(lines, (list, tuple)):
             # ...unless we have all output readily available
             OutputStream.writelines(self, lines)
         else:
             if self.closed:
                 raise IOError('Writing to closed stream {0}'.format(self))
-            write_record = self.conn.write_record
-            record_type = self.record_type
-            request_id = self.request_id
+            write_records = self.conn.write_records
+            records = self._records
             for line in lines:
                 if line:
-                    record = Record(record_type, line, request_id)
-                    write_record(record)
+                    write_records(records((line,)))
+
+    def flush(self):
+        record = self._buffered_record()
+        if record is not None:
+            self.conn.write_record(record)
+
+    def close_records(self, data=b''):
+        records = []
+        if not self.closed:
+            # buffered output goes first
+            record = self._buffered_record()
+            if record is not None:
+                records.append(record)
+        records.extend(OutputStream.close_records(self, data))
+        return records
+
+    def _buffered_record(self):
+        if self._flusher is not None:
+            self._flusher.kill(block=False)
+            self._flusher = None
+        if self._buffer:
+            # buffer is passed to connection as is so start a new one
+            data, self._buffer = self._buffer, bytearray()
+            return Record(self.record_type, data, self.request_id)
+
+    def _delayed_flush(self):
+        self._flusher = None
+        try:
+            self.flush()
+        except Exception:
+            logger.exception('Failed to flush {0}'.format(self))
 
 
 class StderrStream(OutputStream):
 
+    __slots__ = ()
+
     record_type = FCGI_STDERR
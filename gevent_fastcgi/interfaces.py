@@ -29,9 +29,21 @@ class IConnection(Interface):
         Return None if no more records available
         """
 
-    def write_record(record):
+    def write_record(record, request_id=None, content=b''):
         """
-        Serialize and send IRecord instance to peer
+        Serialize and send IRecord instance to peer. Record type, request ID
+        and content can be passed instead of IRecord instance
+        """
+
+    def write_records(records):
+        """
+        Serialize and send sequence of IRecord instances to peer at once
+        """
+
+    def send_file(record_type, request_id, fd, offset, count):
+        """
+        Send count bytes of file fd starting at offset as content of
+        records of record_type
         """
 
     def close():
@@ -48,6 +60,12 @@ class IRequest(Interface):
     stout = Attribute('Standard output stream')
     stderr = Attribute('Standard error stream')
 
+    def end(app_status=0, request_status=0, output=b''):
+        """
+        Send optional output followed by EOF marks of output streams and
+        FCGI_END_REQUEST record
+        """
+
 
 class IRequestHandler(Interface):
 
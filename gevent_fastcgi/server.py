@@ -23,21 +23,31 @@ from __future__ import with_statement, absolute_import
 from gevent.monkey import patch_os
 patch_os()
 
+import gc
 import os
 import six
 import sys
+import mmap
+import time
 import errno
+import random
+import struct
 import logging
+from array import array
 
 import atexit
 if os.name == "nt":
     from signal import SIGINT, SIGTERM
 else:
-    from signal import SIGHUP, SIGKILL, SIGQUIT, SIGINT, SIGTERM
+    from signal import SIGHUP, SIGKILL, SIGQUIT, SIGINT, SIGTERM, SIGUSR2
 
 from zope.interface import implementer
 
-from gevent import sleep, spawn, socket, signal, version_info
+from gevent import sleep, spawn, socket, version_info, getcurrent, get_hub
+try:
+    from gevent import signal_handler as signal
+except ImportError:
+    from gevent import signal
 from gevent.server import StreamServer
 from gevent.event import Event
 try:
@@ -69,12 +79,17 @@ from .base import (
     Connection,
     Record,
     InputStream,
+    BodyTooLarge,
+    MemoryBudget,
     StdoutStream,
     StderrStream,
 )
 from .utils import (
+    CGI_NAMES,
     pack_pairs,
+    pair_size,
     unpack_pairs,
+    unpack_environ_into,
     unpack_begin_request,
     pack_end_request,
     pack_unknown_type,
@@ -88,28 +103,168 @@ logger = logging.getLogger(__name__)
 
 @implementer(IRequest)
 class Request(object):
-    def __init__(self, conn, request_id, role):
+
+    __slots__ = ('conn', 'id', 'role', 'environ', 'stdin_options', 'stdin',
+                 'stdout', 'stderr', 'data', 'greenlet', 'ended', '_params',
+                 '_params_missing', '_params_count')
+
+    def __init__(self, conn, request_id, role, stdout_buffer_size=None,
+                 stdin_options=None):
         self.conn = conn
         self.id = request_id
         self.role = role
         self.environ = {}
-        self.stdin = InputStream()
-        self.stdout = StdoutStream(conn, request_id)
+        self.stdin_options = stdin_options or {}
+        self.stdin = InputStream(**self.stdin_options)
+        self.stdout = StdoutStream(conn, request_id, stdout_buffer_size)
         self.stderr = StderrStream(conn, request_id)
+        # FCGI_DATA stream of FCGI_FILTER request
+        self.data = None
         self.greenlet = None
-        self._environ = InputStream()
+        self.ended = False
+        # pieces of incomplete name-value pair, number of bytes it still
+        # misses (if known) and number of pairs received so far, _params is
+        # set to None once FCGI_PARAMS is closed
+        self._params = []
+        self._params_missing = 0
+        self._params_count = 0
+
+    def end(self, app_status=0, request_status=FCGI_REQUEST_COMPLETE,
+            output=b''):
+        """
+        Close output streams and send FCGI_END_REQUEST. Optional output,
+        stream EOF marks and FCGI_END_REQUEST record are sent at once
+        """
+        if self.ended:
+            return
+        self.ended = True
+        # nobody is going to read the rest of input
+        self.stdin.close()
+        if self.data is not None:
+            self.data.close()
+        records = self.stdout.close_records(output)
+        records.extend(self.stderr.close_records())
+        records.append(Record(FCGI_END_REQUEST, pack_end_request(
+            app_status, request_status), self.id))
+        self.conn.write_records(records)
+
+
+def _writable(buf):
+    return not isinstance(buf, bytes) and not memoryview(buf).readonly
 
 
 class ServerConnection(Connection):
+    """
+    Connection that can be shared by multiple request greenlets.
 
-    def __init__(self, *args, **kw):
-        super(ServerConnection, self).__init__(*args, **kw)
+    If write_queue_size is None writes are serialized with a lock. Otherwise
+    records are put into a queue which is sent by a single flusher greenlet
+    and writers are blocked once more than write_queue_size bytes are queued.
+    """
+
+    def __init__(self, sock, buffer_size=4096, write_queue_size=None):
+        super(ServerConnection, self).__init__(sock, buffer_size)
         self.lock = Semaphore()
+        self.write_queue_size = write_queue_size
+        self._write_queue = []
+        self._queued_bytes = 0
+        self._flusher = None
+        self._flushed = Event()
+        self._write_error = None
+
+    def write_record(self, record, request_id=None, content=b''):
+        if self.write_queue_size is None:
+            with self.lock:
+                super(ServerConnection, self).write_record(
+                    record, request_id, content)
+            return
+
+        if request_id is not None:
+            record = Record(record, content, request_id)
+        self.write_records((record,))
+
+    def write_records(self, records):
+        if self.write_queue_size is None:
+            # We must serialize access for possible multiple request
+            # greenlets
+            with self.lock:
+                super(ServerConnection, self).write_records(records)
+            return
 
-    def write_record(self, record):
-        # We must serialize access for possible multiple request greenlets
+        if self._write_error is not None:
+            raise self._write_error
+
+        for record in records:
+            # record is sent after the call returns so buffers caller may
+            # reuse must be copied
+            content = record.content
+            if isinstance(content, list):
+                if any(map(_writable, content)):
+                    record = record._replace(content=[
+                        memoryview(buf).tobytes() if _writable(buf) else buf
+                        for buf in content])
+            elif _writable(content):
+                record = record._replace(
+                    content=memoryview(content).tobytes())
+            self._write_queue.append(record)
+            self._queued_bytes += record.content_len
+
+        if self._flusher is None:
+            # flusher will pick up everything queued until it's run
+            self._flusher = spawn(self._flush_write_queue)
+
+        while self._queued_bytes > self.write_queue_size:
+            self._flushed.wait()
+            if self._write_error is not None:
+                raise self._write_error
+
+    def send_file(self, record_type, request_id, fd, offset, count):
+        if self.write_queue_size is not None:
+            # queued records go first
+            self.flush()
         with self.lock:
-            super(ServerConnection, self).write_record(record)
+            super(ServerConnection, self).send_file(
+                record_type, request_id, fd, offset, count)
+
+    def flush(self):
+        if self._flusher is not None:
+            self._flusher.join()
+        if self._write_error is not None:
+            raise self._write_error
+
+    def close(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception('Failed to send queued records')
+        finally:
+            super(ServerConnection, self).close()
+
+    def _flush_write_queue(self):
+        write_records = super(ServerConnection, self).write_records
+        try:
+            while self._write_queue:
+                records, self._write_queue = self._write_queue, []
+                try:
+                    # send_file takes the lock too
+                    with self.lock:
+                        write_records(records)
+                except Exception as e:
+                    self._write_error = e
+                    self._write_queue = []
+                    self._queued_bytes = 0
+                    break
+                self._queued_bytes -= sum(
+                    record.content_len for record in records)
+                self._notify_writers()
+        finally:
+            self._flusher = None
+            self._notify_writers()
+
+    def _notify_writers(self):
+        # wake up writers blocked on write queue size
+        flushed, self._flushed = self._flushed, Event()
+        flushed.set()
 
 
 HANDLE_RECORD_ATTR = '_handle_record_type'
@@ -137,19 +292,59 @@ class ConnectionHandlerType(type):
         return type(name, bases, attrs)
 
 class ConnectionHandler(six.with_metaclass(ConnectionHandlerType, object)):
-    def __init__(self, conn, role, capabilities, request_handler):
+    """
+    Requests are handled right in connection greenlet until there are more
+    than one of them at once. Then records are read by separate reader
+    greenlet and every request is handled in its own greenlet.
+    While request handled in connection greenlet waits for input, records
+    are read on its behalf.
+    Drained connection is closed as soon as it has no active requests.
+    """
+
+    __slots__ = ('conn', 'role', 'capabilities', 'request_handler',
+                 'stdout_buffer_size', 'stdin_options', 'max_body_size',
+                 'requests', 'discarded', 'params_cache', 'keep_open',
+                 'closing', '_job_is_done', '_greenlet', '_records',
+                 '_reader', '_inline_request', '_pumping')
+
+    body_too_large_response = (b'Status: 413 Request Entity Too Large\r\n'
+                               b'Content-Length: 0\r\n\r\n')
+
+    def __init__(self, conn, role, capabilities, request_handler,
+                 stdout_buffer_size=None, stdin_options=None,
+                 max_body_size=None):
         self.conn = conn
         self.role = role
         self.capabilities = capabilities
         self.request_handler = request_handler
+        self.stdout_buffer_size = stdout_buffer_size
+        self.stdin_options = stdin_options
+        self.max_body_size = max_body_size
         self.requests = {}
+        # types of input streams still open by request ID for requests ended
+        # before receiving all input, their records are skipped
+        self.discarded = {}
+        # name-value pairs seen in FCGI_PARAMS of previous requests
+        self.params_cache = []
         self.keep_open = None
         self.closing = False
         self._job_is_done = Event()
+        self._greenlet = None
+        self._records = None
+        self._reader = None
+        self._inline_request = None
+        self._pumping = False
 
     def run(self):
-        reader = spawn(self.read_records)
-        reader.link(self._report_finished_job)
+        self._greenlet = getcurrent()
+        self._records = iter(self.conn)
+        self.read_records()
+        reader = self._reader
+        if reader is None:
+            logger.debug('Closing connection')
+            self.conn.close()
+            return
+
         event = self._job_is_done
 
         while True:
@@ -163,8 +358,11 @@ class ConnectionHandler(six.with_metaclass(ConnectionHandlerType, object)):
             else:
                 break
 
-        reader.kill()
-        reader.join()
+        if not reader.ready():
+            reader.kill()
+            reader.join()
+            # killed reader keeps traceback referencing this handler
+            self._reader = None
         logger.debug('Closing connection')
         self.conn.close()
 
@@ -181,38 +379,113 @@ class ConnectionHandler(six.with_metaclass(ConnectionHandlerType, object)):
     def end_request(self, request, request_status=FCGI_REQUEST_COMPLETE,
                     app_status=0):
         try:
-            request.stdout.close()
-            request.stderr.close()
-            self.send_record(FCGI_END_REQUEST, pack_end_request(
-                app_status, request_status), request.id)
+            request.end(app_status, request_status)
         finally:
-            del self.requests[request.id]
+            # greenlet of failed handler keeps traceback referencing request
+            request.greenlet = None
+            # request might have been ended by request handler already and
+            # its ID reused by Web-server
+            if self.requests.get(request.id) is request:
+                del self.requests[request.id]
+                streams = set(
+                    record_type for record_type, stream in (
+                        (FCGI_STDIN, request.stdin),
+                        (FCGI_DATA, request.data),
+                    ) if stream is not None and not stream.eof_received)
+                if streams:
+                    self.discarded[request.id] = streams
             logger.debug('Request {0} ended'.format(request.id))
 
-    def read_records(self):
-        record_handlers = self._record_handlers
-        requests = self.requests
-        for record in self.conn:
-            handler = record_handlers.get(record.type)
-            if handler is None:
-                logger.error('{0}: Unknown record type'.format(record))
-                self.send_record(FCGI_UNKNOWN_TYPE,
-                                 pack_unknown_type(record.type))
-                break
+    def reject_body(self, request):
+        """
+        Deal with request which body is larger than allowed. Respond with
+        413 status if request handler is not running yet, otherwise make
+        it fail reading request body
+        """
+        logger.warning('Request {0} body is too large'.format(request.id))
+        if request.greenlet is None:
+            request.end(output=self.body_too_large_response)
+            self.end_request(request)
+            self._report_finished_job()
+        else:
+            request.stdin.discard(BodyTooLarge(
+                'Request body is larger than {0} bytes'.format(
+                    self.max_body_size)))
 
-            if record.type in EXISTING_REQUEST_RECORD_TYPES:
-                request = requests.get(record.request_id)
-                if request is None:
-                    logger.error(
-                        'Record {0} for non-existent request'.format(record))
+    def read_records(self):
+        inline = self._reader is None
+        handle_record = self.handle_record
+        event = self._job_is_done
+        job_done = False
+        try:
+            for record in self._records:
+                if not handle_record(record):
                     break
-                handler(self, record, request)
-            else:
-                handler(self, record)
+                if inline:
+                    if self._reader is not None:
+                        # reader greenlet takes over
+                        return
+                    if event.is_set():
+                        event.clear()
+                        job_done = True
+                    # without FCGI_KEEP_CONN connection is closed once there
+                    # are no active requests unless Web-server has already
+                    # sent records of another one
+                    if (job_done and not (self.requests or self.keep_open)
+                            and not self.conn.received()):
+                        return
+        except socket.error:
+            # reading was shut down by drain
+            if not self.closing:
+                raise
+
+    def drain(self):
+        """
+        Close connection once active requests are done even if Web-server
+        asked to keep it open
+        """
+        self.closing = True
+        self.keep_open = False
+        if not self.requests:
+            # wake up greenlet waiting for next request
+            try:
+                self.conn.done_reading()
+            except socket.error:
+                pass
+        self._report_finished_job()
+
+    def handle_record(self, record):
+        """
+        Return False if connection must be closed because of this record
+        """
+        handler = self._record_handlers.get(record.type)
+        if handler is None:
+            logger.error('{0}: Unknown record type'.format(record))
+            self.send_record(FCGI_UNKNOWN_TYPE,
+                             pack_unknown_type(record.type))
+            return False
+
+        if record.type in EXISTING_REQUEST_RECORD_TYPES:
+            request = self.requests.get(record.request_id)
+            if request is None:
+                streams = self.discarded.get(record.request_id)
+                if streams is not None and record.type in streams:
+                    if not record.content:
+                        streams.discard(record.type)
+                        if not streams:
+                            del self.discarded[record.request_id]
+                    return True
+                logger.error(
+                    'Record {0} for non-existent request'.format(record))
+                return False
+            handler(self, record, request)
+        else:
+            handler(self, record)
+        return True
 
     def send_record(
             self, record_type, content='', request_id=FCGI_NULL_REQUEST_ID):
-        self.conn.write_record(Record(record_type, content, request_id))
+        self.conn.write_record(record_type, request_id, content)
 
     @record_handler(FCGI_GET_VALUES)
     def handle_get_values_record(self, record):
@@ -237,34 +510,73 @@ class ConnectionHandler(six.with_metaclass(ConnectionHandlerType, object)):
             # Should we check this for every request instead?
             if self.keep_open is None:
                 self.keep_open = bool(FCGI_KEEP_CONN & flags)
-            request = Request(self.conn, record.request_id, role)
+            # previous request with the same ID is over for sure
+            self.discarded.pop(record.request_id, None)
+            request = Request(self.conn, record.request_id, role,
+                              self.stdout_buffer_size, self.stdin_options)
             if role == FCGI_FILTER:
-                request.data = InputStream()
+                request.data = InputStream(**request.stdin_options)
             self.requests[request.id] = request
 
     @record_handler(FCGI_STDIN)
     def handle_stdin_record(self, record, request):
-        request.stdin.feed(record.content)
+        stdin = request.stdin
+        if (self.max_body_size is not None and not stdin.discarded
+                and stdin.size + len(record.content) > self.max_body_size):
+            self.reject_body(request)
+            if request.ended:
+                return
+        stdin.feed(record.content)
+        # pausing before request handler is started would never end and
+        # request handled in this greenlet reads records itself
+        if request.greenlet not in (None, getcurrent()):
+            stdin.wait_drained()
 
     @record_handler(FCGI_DATA)
     def handle_data_record(self, record, request):
         request.data.feed(record.content)
-        if not record.content and request.role == FCGI_FILTER:
-            self.spawn_request_handler(request)
+        if (not record.content and request.role == FCGI_FILTER
+                and not request.ended):
+            self.start_request(request)
 
     @record_handler(FCGI_PARAMS)
     def handle_params_record(self, record, request):
-        request._environ.feed(record.content)
-        if not record.content:
+        content = record.content
+        params = request._params
+        if params is None:
+            raise IOError('Received FCGI_PARAMS beyond EOF mark')
+
+        if content:
+            if params:
+                # name-value pair was split between records, its pieces are
+                # joined once all of them are received
+                params.append(memoryview(content).tobytes())
+                request._params_missing -= len(content)
+                if request._params_missing > 0:
+                    return
+                content = b''.join(params)
+                del params[:]
+            consumed, request._params_count = unpack_environ_into(
+                request.environ, content, self.params_cache, CGI_NAMES,
+                request._params_count)
+            if consumed < len(content):
+                tail = memoryview(content)[consumed:].tobytes()
+                params.append(tail)
+                # lengths may be split too, then pieces are joined as soon
+                # as next one is received
+                request._params_missing = pair_size(tail) - len(tail)
+        else:
             # EOF received
-            request.environ = dict(unpack_pairs(request._environ.read()))
-            del request._environ
+            if params:
+                raise ValueError(
+                    'FCGI_PARAMS stream ends with incomplete name-value pair')
+            request._params = None
 
-            # Unicode compatibility
-            for key in list(request.environ.keys()):
-                request.environ[key.decode("ISO-8859-1")] = request.environ[key].decode("ISO-8859-1")
-            if request.role in (FCGI_RESPONDER, FCGI_AUTHORIZER):
-                self.spawn_request_handler(request)
+            if (self.max_body_size is not None
+                    and self._content_length(request) > self.max_body_size):
+                self.reject_body(request)
+            elif request.role in (FCGI_RESPONDER, FCGI_AUTHORIZER):
+                self.start_request(request)
 
     @record_handler(FCGI_ABORT_REQUEST)
     def handle_abort_request_record(self, record, request):
@@ -274,6 +586,18 @@ class ConnectionHandler(six.with_metaclass(ConnectionHandlerType, object)):
             if greenlet is None:
                 self.end_request(request)
                 self._report_finished_job()
+            elif greenlet is self._greenlet:
+                if greenlet is getcurrent():
+                    # request is waiting for input right here
+                    raise self.RequestAborted()
+                # connection greenlet must not be killed, make request
+                # handler fail instead
+                error = IOError('Request aborted')
+                request.stdin.discard(error)
+                if request.data is not None:
+                    request.data.discard(error)
+                self.end_request(request)
+                self._report_finished_job()
             else:
                 logger.warn('Killing greenlet {0} for request {1}'.format(
                     greenlet, request.id))
@@ -282,6 +606,79 @@ class ConnectionHandler(six.with_metaclass(ConnectionHandlerType, object)):
         else:
             logger.debug('Request {0} not found'.format(request.id))
 
+    @staticmethod
+    def _content_length(request):
+        try:
+            return int(request.environ.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            return 0
+
+    def start_request(self, request):
+        if (self._reader is None
+                and self._inline_request is None
+                and len(self.requests) == 1
+                and getcurrent() is self._greenlet):
+            self.run_request_handler(request)
+        else:
+            if self._reader is None:
+                self._start_reader()
+            self.spawn_request_handler(request)
+
+    def run_request_handler(self, request):
+        """
+        Handle request in connection greenlet
+        """
+        self._inline_request = request
+        request.greenlet = self._greenlet
+        request.stdin.pump = self._pump
+        if request.data is not None:
+            request.data.pump = self._pump
+        try:
+            self.handle_request(request)
+        except (Exception, self.RequestAborted):
+            # already logged by handle_request
+            pass
+        finally:
+            self._inline_request = None
+            self._report_finished_job()
+
+    def _pump(self):
+        """
+        Read and handle next record while request handled in connection
+        greenlet waits for input. Return False once it's not possible
+        """
+        if self._reader is not None:
+            return False
+        if getcurrent() is not self._greenlet:
+            # somebody else is waiting, let reader greenlet do the job
+            if not self._pumping:
+                self._start_reader()
+            return False
+
+        self._pumping = True
+        try:
+            record = next(self._records, None)
+            if record is not None and self.handle_record(record):
+                return self._reader is None
+        except Exception:
+            logger.exception('Failed to handle record')
+        finally:
+            self._pumping = False
+
+        # no more records
+        self._records = iter(())
+        request = self._inline_request
+        if request is not None:
+            error = IOError('Connection closed')
+            request.stdin.discard(error)
+            if request.data is not None:
+                request.data.discard(error)
+        return False
+
+    def _start_reader(self):
+        self._reader = reader = spawn(self.read_records)
+        reader.link(self._report_finished_job)
+
     def spawn_request_handler(self, request):
         request.greenlet = g = spawn(self.handle_request, request)
         g.link(self._report_finished_job)
@@ -289,6 +686,11 @@ class ConnectionHandler(six.with_metaclass(ConnectionHandlerType, object)):
     def _report_finished_job(self, source=None):
         self._job_is_done.set()
 
+    class RequestAborted(BaseException):
+        """ Raised in request handler running in connection greenlet once
+        request is aborted
+        """
+
 
 class FastCGIServer(StreamServer):
     """
@@ -296,11 +698,64 @@ class FastCGIServer(StreamServer):
     It is request_handler's responsibility to choose protocol and deal with
     application invocation. gevent_fastcgi.wsgi module contains WSGI
     protocol implementation.
+
+    With reuse_port set every worker process listens on its own TCP socket
+    bound with SO_REUSEPORT so the kernel balances connections between them
+    instead of waking all workers on shared socket.
+
+    With master_accept set master process accepts connections itself and
+    passes them over UNIX socket pairs to worker with least active requests.
+
+    With preload set master process calls it (if it's callable) to warm up
+    application, collects garbage and freezes all objects left before
+    forking workers so garbage collector does not touch memory pages
+    shared by them.
+
+    Worker is recycled once it has handled max_requests (plus random number
+    up to max_requests_jitter) requests, its RSS has grown over max_rss
+    bytes or it has been running for max_age seconds. Master starts
+    replacement first then retiring worker stops accepting connections and
+    exits once its active requests are done or drain_timeout seconds have
+    passed.
+
+    Master process restarts worker as soon as it exits. Workers that keep
+    exiting within startup_period seconds after start are restarted with
+    exponentially growing delay starting at respawn_delay and limited by
+    max_respawn_delay seconds.
     """
 
+    recycle_interval = 1
+    startup_period = 1
+    respawn_delay = 0.1
+    max_respawn_delay = 30
+
     def __init__(self, listener, request_handler, role=FCGI_RESPONDER,
                  num_workers=1, buffer_size=1024, max_conns=1024,
-                 socket_mode=None, **kwargs):
+                 socket_mode=None, write_queue_size=None,
+                 stdout_buffer_size=None, stdin_max_mem=1024,
+                 stdin_spool_dir=None, stdin_offload=False,
+                 stdin_memory_budget=None, stdin_streaming=False,
+                 stdin_high_water_mark=None, max_body_size=None,
+                 reuse_port=False, master_accept=False, preload=False,
+                 max_requests=None, max_requests_jitter=0, max_rss=None,
+                 max_age=None, drain_timeout=30, **kwargs):
+        if master_accept:
+            if not hasattr(socket, 'SCM_RIGHTS'):
+                raise ValueError('Passing connections to workers is not '
+                                 'supported')
+            if reuse_port:
+                raise ValueError(
+                    'reuse_port and master_accept are mutually exclusive')
+        self.master_accept = master_accept
+        self.preload = preload
+        if reuse_port:
+            if not hasattr(socket, 'SO_REUSEPORT'):
+                raise ValueError('SO_REUSEPORT is not supported')
+            if not isinstance(listener, tuple):
+                raise ValueError(
+                    'reuse_port requires (host, port) listener address')
+        self.reuse_port = reuse_port
+
         # StreamServer does not create UNIX-sockets
         if isinstance(listener, six.string_types):
             self._socket_file = listener
@@ -323,15 +778,54 @@ class FastCGIServer(StreamServer):
         self.role = role
         self.request_handler = request_handler
         self.buffer_size = buffer_size
+        self.write_queue_size = write_queue_size
+        self.stdout_buffer_size = stdout_buffer_size
+        self.max_body_size = max_body_size
+        # shared by all requests of the worker process
+        if stdin_memory_budget is None:
+            self.stdin_budget = None
+        else:
+            self.stdin_budget = MemoryBudget(stdin_memory_budget)
+        self.stdin_options = dict(
+            max_mem=stdin_max_mem,
+            spool_dir=stdin_spool_dir,
+            offload=stdin_offload,
+            budget=self.stdin_budget,
+            streaming=stdin_streaming,
+            high_water_mark=stdin_high_water_mark,
+        )
         self.capabilities = dict(
             FCGI_MAX_CONNS=str(max_conns),
             FCGI_MAX_REQS=str(max_conns * 1024),
             FCGI_MPXS_CONNS='1',
         )
 
+        self.max_requests = max_requests
+        self.max_requests_jitter = max_requests_jitter
+        self.max_rss = max_rss
+        self.max_age = max_age
+        self.drain_timeout = drain_timeout
+
         self.num_workers = int(num_workers)
         assert self.num_workers > 0, 'num_workers must be positive number'
         self._workers = []
+        # master process: counters shared with workers and WorkerState
+        # instances keyed by PID. worker process: its counters slot and
+        # channel to receive connections from
+        self._load = None
+        self._states = None
+        self._dispatching = False
+        self._slot = None
+        self._channel = None
+        self._receiver = None
+        self._recycler = None
+        self._handlers = set()
+        # master process: set on SIGCHLD to wake supervisor up, number of
+        # workers crashed in a row at startup and when to start them again
+        self._children_exited = Event()
+        self._crashes = 0
+        self._respawn_at = None
+        self._stopping = False
 
     def start(self):
         logger.debug('Starting server')
@@ -340,8 +834,19 @@ class FastCGIServer(StreamServer):
                 self._create_socket_file()
             super(FastCGIServer, self).start()
             if self.num_workers > 1:
+                # retiring workers take extra slots until they exit
+                self._load = WorkerLoad(self.num_workers * 2)
+                self._states = {}
+                if self.preload:
+                    self._preload()
                 self._start_workers()
+                if self.master_accept:
+                    self._dispatching = True
+                    self.start_accepting()
                 self._supervisor = spawn(self._watch_workers)
+                if (self.max_requests or self.max_rss or
+                        self.max_age is not None):
+                    self._recycler = spawn(self._recycle_workers)
                 atexit.register(self._cleanup)
                 sig_register = [SIGTERM, SIGINT]
                 if os.name != "nt":
@@ -349,27 +854,133 @@ class FastCGIServer(StreamServer):
                 for signum in sig_register:
                     signal(signum, sys.exit, 1)
 
+    def init_socket(self):
+        if self.reuse_port and not hasattr(self, 'socket'):
+            # master process with workers only holds the port, it must not
+            # listen or kernel would hand connections to it too
+            backlog = self.backlog if self.num_workers == 1 else None
+            self.socket = reuse_port_socket(
+                self.address, self.family, backlog)
+            self.address = self.socket.getsockname()
+        super(FastCGIServer, self).init_socket()
+
     def start_accepting(self):
-        # master proceess with workers should not start accepting
-        if self._workers is None or self.num_workers == 1:
+        if self._channel is not None:
+            # worker receives connections from master process
+            if self._receiver is None:
+                self._receiver = spawn(self._receive_connections)
+        # master proceess with workers should not start accepting unless
+        # it passes connections to workers
+        elif (self._workers is None or self.num_workers == 1
+                or self._dispatching):
             super(FastCGIServer, self).start_accepting()
 
     def stop_accepting(self):
+        if self._channel is not None:
+            if self._receiver is not None:
+                self._receiver.kill(block=False)
+                self._receiver = None
         # master proceess with workers did not start accepting
-        if self._workers is None or self.num_workers == 1:
+        elif (self._workers is None or self.num_workers == 1
+                or self._dispatching):
             super(FastCGIServer, self).stop_accepting()
 
     def handle_connection(self, sock, addr):
+        if self._dispatching:
+            return self._dispatch_connection(sock)
         if sock.family in (socket.AF_INET, socket.AF_INET6):
             sock.setsockopt(socket.SOL_TCP, socket.TCP_NODELAY, 1)
             sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
                             self.buffer_size)
             sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF,
                             self.buffer_size)
-        conn = ServerConnection(sock, self.buffer_size)
+        conn = ServerConnection(
+            sock, self.buffer_size, self.write_queue_size)
+        if self._slot is None:
+            request_handler = self.request_handler
+        else:
+            request_handler = self._handle_counted_request
         handler = ConnectionHandler(
-            conn, self.role, self.capabilities, self.request_handler)
-        handler.run()
+            conn, self.role, self.capabilities, request_handler,
+            self.stdout_buffer_size, self.stdin_options, self.max_body_size)
+        self._handlers.add(handler)
+        try:
+            handler.run()
+        finally:
+            self._handlers.discard(handler)
+
+    def _handle_counted_request(self, request):
+        load = self._load
+        load.request_started(self._slot)
+        try:
+            self.request_handler(request)
+        finally:
+            load.request_finished(self._slot)
+
+    def _dispatch_connection(self, sock):
+        """
+        Pass connection accepted by master process to worker with least
+        active requests and connections passed but not received yet
+        """
+        load = self._load
+        states = sorted(
+            (state for state in self._states.values() if not state.retiring),
+            key=lambda state: load.active(state.slot) +
+            state.dispatched - load.received(state.slot))
+        fds = [(socket.SOL_SOCKET, socket.SCM_RIGHTS,
+                array('i', [sock.fileno()]))]
+        for state in states:
+            try:
+                state.channel.sendmsg([b'\0'], fds)
+            except socket.error:
+                # worker has died but is not reaped yet
+                logger.debug('Failed to pass connection to worker')
+            else:
+                state.dispatched += 1
+                return
+        logger.error('No worker to pass connection to')
+
+    def _receive_connections(self):
+        channel = self._channel
+        load = self._load
+        fd_size = array('i').itemsize
+        while True:
+            data, ancdata, flags, _ = channel.recvmsg(
+                1, socket.CMSG_SPACE(fd_size))
+            fds = array('i')
+            for level, kind, cmsg in ancdata:
+                if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+                    fds.frombytes(cmsg[:len(cmsg) - len(cmsg) % fd_size])
+            if not data:
+                logger.debug('Master process closed channel')
+                for fd in fds:
+                    os.close(fd)
+                break
+            if flags & socket.MSG_CTRUNC:
+                logger.error('Descriptors passed by master process were '
+                             'truncated')
+                for fd in fds:
+                    os.close(fd)
+                continue
+            for fd in fds:
+                load.connection_received(self._slot)
+                try:
+                    sock = socket.socket(fileno=fd)
+                except socket.error:
+                    os.close(fd)
+                    logger.exception('Failed to use received connection')
+                    continue
+                try:
+                    self._spawn(self._handle_received_connection, sock)
+                except:
+                    sock.close()
+                    raise
+
+    def _handle_received_connection(self, sock):
+        try:
+            self.handle_connection(sock, None)
+        finally:
+            sock.close()
 
     if version_info < (1,):
         # older version of gevent
@@ -381,23 +992,77 @@ class FastCGIServer(StreamServer):
             super(FastCGIServer, self).close()
             self._cleanup()
 
+    def worker_memory(self):
+        """
+        Return dict of (RSS, USS) tuples in bytes keyed by worker PID.
+        USS is memory not shared with master or other workers. Tuple is
+        None if it can't be found out
+        """
+        return dict((pid, process_memory(pid)) for pid in self._workers or ())
+
+    def _preload(self):
+        if callable(self.preload):
+            logger.debug('Preloading application')
+            self.preload()
+        gc.collect()
+        if hasattr(gc, 'freeze'):
+            # objects moved to permanent generation are never scanned by GC
+            gc.freeze()
+            logger.debug('{0} objects frozen before forking workers'.format(
+                gc.get_freeze_count()))
+
     def _start_workers(self):
-        while len(self._workers) < self.num_workers:
+        retiring = sum(state.retiring for state in self._states.values())
+        while len(self._workers) - retiring < self.num_workers:
             self._start_worker()
 
     def _start_worker(self):
         if os.name == "nt":
             raise NotImplemented("Multiple workers not supported on Windows")
+        used = set(state.slot for state in self._states.values())
+        slot = min(set(range(self._load.num_slots)) - used)
+        self._load.reset(slot)
+        if self.master_accept:
+            master_end, worker_end = socket.socketpair()
+        else:
+            master_end = worker_end = None
+        max_requests = self.max_requests
+        if max_requests and self.max_requests_jitter:
+            # keep workers started together from retiring at once
+            max_requests += random.randint(0, self.max_requests_jitter)
         pid = os.fork()
         if pid:
             # master process
             self._workers.append(pid)
+            if worker_end is not None:
+                worker_end.close()
+            self._states[pid] = WorkerState(slot, max_requests, master_end)
             logger.debug('Started worker {0}'.format(pid))
             return pid
         else:
             try:
                 # this indicates current process is a worker
                 self._workers = None
+                if self._dispatching:
+                    # accepting is left to master process
+                    self.stop_accepting()
+                    self._dispatching = False
+                for state in self._states.values():
+                    if state.channel is not None:
+                        state.channel.close()
+                self._states = None
+                # worker could be forked by any of them and must not kill
+                # greenlet it runs in
+                current = getcurrent()
+                for name in ('_supervisor', '_recycler'):
+                    greenlet = getattr(self, name, None)
+                    if greenlet is not None and greenlet is not current:
+                        greenlet.kill(block=False)
+                    setattr(self, name, None)
+                if master_end is not None:
+                    master_end.close()
+                self._channel = worker_end
+                self._slot = slot
                 devnull_fd = os.open(os.devnull, os.O_RDWR)
                 try:
                     for fd in (0,):
@@ -406,30 +1071,155 @@ class FastCGIServer(StreamServer):
                     os.close(devnull_fd)
                 if os.name != "nt":
                     signal(SIGHUP, self.stop)
+                    signal(SIGUSR2, self._drain)
+                if self.reuse_port:
+                    self._listen_reuse_port()
                 self.start_accepting()
                 super(FastCGIServer, self).serve_forever()
             finally:
                 # worker must never return
                 os._exit(0)
 
-    def _watch_workers(self, check_interval=5):
-        keep_running = True
-        while keep_running:
-            self._start_workers()
+    def _listen_reuse_port(self):
+        """
+        Replace socket inherited from master process with worker's own one
+        """
+        inherited = self.socket
+        self.socket = reuse_port_socket(
+            self.address, self.family, self.backlog)
+        self.init_socket()
+        inherited.close()
 
-            try:
+    def _drain(self):
+        """
+        Stop accepting connections and wait for active requests to be done
+        before stopping worker
+        """
+        logger.debug('Draining worker {0}'.format(os.getpid()))
+        self.stop_accepting()
+        for handler in list(self._handlers):
+            handler.drain()
+        # serve_forever stops server with stop_timeout too once it returns
+        self.stop_timeout = self.drain_timeout
+        self.stop()
+
+    def _recycle_workers(self):
+        while True:
+            sleep(self.recycle_interval)
+            for pid, state in list(self._states.items()):
+                if state.retiring:
+                    continue
+                reason = self._worker_limit_reached(state, pid)
+                if reason is not None:
+                    self._retire_worker(pid, reason)
+
+    def _worker_limit_reached(self, state, pid):
+        if (state.max_requests and
+                self._load.handled(state.slot) >= state.max_requests):
+            return 'handled {0} requests'.format(state.max_requests)
+        if self.max_rss:
+            rss = process_rss(pid)
+            if rss is not None and rss > self.max_rss:
+                return 'RSS is {0} bytes'.format(rss)
+        if (self.max_age is not None and
+                time.time() - state.started >= self.max_age):
+            return 'running for {0} seconds'.format(self.max_age)
+
+    def _retire_worker(self, pid, reason):
+        if len(self._states) >= self._load.num_slots:
+            # too many workers are retiring already
+            return
+        logger.info('Recycling worker {0}: {1}'.format(pid, reason))
+        self._states[pid].retiring = True
+        # start replacement first so capacity does not drop
+        self._start_workers()
+        try:
+            os.kill(pid, SIGUSR2)
+        except OSError as x:
+            if x.errno != errno.ESRCH:
+                raise
+
+    def _watch_workers(self, check_interval=5):
+        # event loop reaps children on SIGCHLD and wakes supervisor up so
+        # exited worker is replaced immediately
+        watcher = get_hub().loop.child(0, False)
+        watcher.start(self._children_exited.set)
+        try:
+            keep_running = True
+            while keep_running:
                 try:
-                    sleep(check_interval)
-                    self._reap_workers()
-                except self.Stop:
-                    logger.debug('Waiting for all workers to exit')
-                    keep_running = False
-                    self._reap_workers(True)
-            except OSError as e:
-                if e.errno != errno.ECHILD:
-                    logger.exception('Failed to wait for any worker to exit')
-                else:
-                    logger.debug('No alive workers left')
+                    try:
+                        timeout = self._respawn_workers(check_interval)
+                        self._children_exited.wait(timeout)
+                        self._children_exited.clear()
+                        self._reap_workers()
+                        if logger.isEnabledFor(logging.DEBUG):
+                            for pid, memory in self.worker_memory().items():
+                                if memory is not None:
+                                    logger.debug(
+                                        'Worker {0} RSS {1} USS {2}'.format(
+                                            pid, *memory))
+                    except self.Stop:
+                        logger.debug('Waiting for all workers to exit')
+                        keep_running = False
+                        self._reap_workers(True)
+                except OSError as e:
+                    if e.errno != errno.ECHILD:
+                        logger.exception(
+                            'Failed to wait for any worker to exit')
+                    else:
+                        logger.debug('No alive workers left')
+        finally:
+            watcher.stop()
+
+    def _respawn_workers(self, check_interval):
+        """
+        Start missing workers unless restart is delayed because of workers
+        crashing at startup. Returns number of seconds supervisor may wait
+        for workers to exit before calling it again
+        """
+        if self._stopping:
+            return check_interval
+        now = time.time()
+        if self._respawn_at is not None:
+            if now < self._respawn_at:
+                return min(check_interval, self._respawn_at - now)
+            self._respawn_at = None
+        self._start_workers()
+        if self._crashes:
+            if all(now - state.started >= self.startup_period
+                   for state in self._states.values()):
+                logger.info('Workers are running again after {0} crashes'
+                            .format(self._crashes))
+                self._crashes = 0
+            else:
+                return min(check_interval, self.startup_period)
+        return check_interval
+
+    def _worker_exited(self, pid, state, status):
+        if state.retiring or self._stopping:
+            logger.debug('Worker {0} exited'.format(pid))
+            return
+        uptime = time.time() - state.started
+        if uptime >= self.startup_period:
+            logger.warning(
+                'Worker {0} exited unexpectedly with status {1} after '
+                '{2:.1f} seconds'.format(pid, status, uptime))
+            self._crashes = 0
+            return
+        self._crashes += 1
+        if self._crashes == 1:
+            logger.warning(
+                'Worker {0} exited with status {1} {2:.3f} seconds after '
+                'start'.format(pid, status, uptime))
+            return
+        delay = min(self.respawn_delay * 2 ** (self._crashes - 2),
+                    self.max_respawn_delay)
+        self._respawn_at = time.time() + delay
+        logger.error(
+            'Worker {0} exited with status {1} {2:.3f} seconds after start, '
+            '{3} workers crashed in a row at startup, restarting in {4:.1f} '
+            'seconds'.format(pid, status, uptime, self._crashes, delay))
 
     def _reap_workers(self, block=False):
         flags = 0 if block else os.WNOHANG
@@ -438,14 +1228,21 @@ class FastCGIServer(StreamServer):
             if pid == 0:
                 break
             elif pid in self._workers:
-                logger.debug('Worker {0} exited'.format(pid))
                 self._workers.remove(pid)
+                state = self._states.pop(pid)
+                if state.channel is not None:
+                    state.channel.close()
+                self._worker_exited(pid, state, status)
 
     def _cleanup(self):
         if hasattr(self, '_workers'):
             # it was initialized
             if self._workers is not None:
                 # master process
+                self._stopping = True
+                if self._recycler is not None:
+                    self._recycler.kill()
+                    self._recycler = None
                 try:
                     self._kill_workers()
                 finally:
@@ -480,7 +1277,7 @@ class FastCGIServer(StreamServer):
             return
         for sig in SIGHUP, SIGKILL:
             if not self._workers:
-                raise StopIteration
+                return
             logger.debug('Killing workers {0} with signal {1}'.
                          format(self._workers, sig))
             for pid in self._workers[:]:
@@ -519,3 +1316,120 @@ class FastCGIServer(StreamServer):
     class Stop(BaseException):
         """ Used to signal watcher greenlet
         """
+
+
+class WorkerState(object):
+    """
+    What master process knows about worker process
+    """
+
+    __slots__ = ('slot', 'started', 'max_requests', 'channel', 'dispatched',
+                 'retiring')
+
+    def __init__(self, slot, max_requests=None, channel=None):
+        self.slot = slot
+        self.started = time.time()
+        self.max_requests = max_requests
+        # master process end of socket pair used to pass connections
+        self.channel = channel
+        # number of connections passed to worker
+        self.dispatched = 0
+        self.retiring = False
+
+
+class WorkerLoad(object):
+    """
+    Counters of active and handled requests and received connections of
+    worker processes kept in anonymous shared memory. Every worker updates
+    its own slot only, master process reads them to choose worker for
+    connection or to recycle it. Must be created before forking workers
+    """
+
+    _counters = struct.Struct('=qQQ')
+
+    def __init__(self, num_slots):
+        self.num_slots = num_slots
+        self._mem = mmap.mmap(-1, self._counters.size * num_slots)
+
+    def reset(self, slot):
+        self._counters.pack_into(
+            self._mem, slot * self._counters.size, 0, 0, 0)
+
+    def active(self, slot):
+        return self._get(slot)[0]
+
+    def received(self, slot):
+        return self._get(slot)[1]
+
+    def handled(self, slot):
+        return self._get(slot)[2]
+
+    def request_started(self, slot):
+        self._add(slot, 1, 0, 0)
+
+    def request_finished(self, slot):
+        self._add(slot, -1, 0, 1)
+
+    def connection_received(self, slot):
+        self._add(slot, 0, 1, 0)
+
+    def _get(self, slot):
+        return self._counters.unpack_from(
+            self._mem, slot * self._counters.size)
+
+    def _add(self, slot, active, received, handled):
+        counters = self._get(slot)
+        self._counters.pack_into(
+            self._mem, slot * self._counters.size, counters[0] + active,
+            counters[1] + received, counters[2] + handled)
+
+
+def process_memory(pid):
+    """
+    Return (RSS, USS) tuple in bytes of process with specified PID from
+    /proc/PID/smaps_rollup or /proc/PID/smaps or None if neither is there
+    """
+    for name in ('smaps_rollup', 'smaps'):
+        try:
+            with open('/proc/{0}/{1}'.format(pid, name)) as smaps:
+                rss = uss = 0
+                for line in smaps:
+                    if line.startswith('Rss:'):
+                        rss += int(line.split()[1])
+                    elif line.startswith(('Private_Clean:', 'Private_Dirty:')):
+                        uss += int(line.split()[1])
+                return rss * 1024, uss * 1024
+        except (IOError, OSError):
+            continue
+    return None
+
+
+def process_rss(pid):
+    """
+    Return RSS in bytes of process with specified PID from /proc/PID/statm
+    or None if it's not there
+    """
+    try:
+        with open('/proc/{0}/statm'.format(pid)) as statm:
+            return int(statm.read().split()[1]) * mmap.PAGESIZE
+    except (IOError, OSError):
+        return None
+
+
+def reuse_port_socket(address, family=socket.AF_INET, backlog=None):
+    """
+    Create non-blocking TCP socket bound to address with SO_REUSEPORT.
+    Socket is put into listening state only if backlog is specified
+    """
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind(address)
+        if backlog is not None:
+            sock.listen(backlog)
+    except:
+        sock.close()
+        raise
+    sock.setblocking(0)
+    return sock
@@ -34,6 +34,7 @@
 
 #define ENSURE_LEN(req) if ((end - buf) < (req)) { \
 	Py_XDECREF(result); \
+	PyBuffer_Release(&view); \
 	return PyErr_Format(PyExc_ValueError, "Buffer is %ld byte(s) short", (req) - (end - buf)); \
 }
 
@@ -48,14 +49,20 @@
 static PyObject *
 py_unpack_pairs(PyObject *self, PyObject *args) {
 	unsigned char *buf, *name, *value, *end;
-	Py_ssize_t blen, nlen, vlen;
+	Py_ssize_t nlen, vlen;
+	Py_buffer view;
 	PyObject *result, *tuple;
 
-	if (!PyArg_ParseTuple(args, "s#:unpack_pairs", &buf, &blen)) {
+	#if PY_MAJOR_VERSION >= 3
+	if (!PyArg_ParseTuple(args, "y*:unpack_pairs", &view)) {
+	#else
+	if (!PyArg_ParseTuple(args, "s*:unpack_pairs", &view)) {
+	#endif
 		return PyErr_Format(PyExc_ValueError, "Single string argument expected");
 	}
 
-	end = buf + blen;
+	buf = (unsigned char *) view.buf;
+	end = buf + view.len;
 	result = PyList_New(0);
 
 	if (result) {
@@ -77,14 +84,220 @@ py_unpack_pairs(PyObject *self, PyObject *args) {
 				Py_DECREF(tuple);
 			} else {
 				Py_XDECREF(result);
+				PyBuffer_Release(&view);
 				return PyErr_Format(PyExc_RuntimeError, "Failed to allocate memory for next name/value tuple");
 			}
 		}
 	}
 
+	PyBuffer_Release(&view);
 	return result;
 }
 
+#if PY_MAJOR_VERSION >= 3
+#define NativeString_FromStringAndSize(s, len) PyUnicode_DecodeLatin1((const char *)(s), len, NULL)
+#define NativeString_Check PyUnicode_CheckExact
+#define NativeString_EQUALS(str, s, len) (PyUnicode_GET_LENGTH(str) == (len) && \
+	PyUnicode_KIND(str) == PyUnicode_1BYTE_KIND && \
+	memcmp(PyUnicode_1BYTE_DATA(str), (s), (len)) == 0)
+#else
+#define NativeString_FromStringAndSize(s, len) PyString_FromStringAndSize((const char *)(s), len)
+#define NativeString_Check PyString_CheckExact
+#define NativeString_EQUALS(str, s, len) (PyString_GET_SIZE(str) == (len) && \
+	memcmp(PyString_AS_STRING(str), (s), (len)) == 0)
+#endif
+
+/* Same as PARAMS_CACHE_SIZE and PARAMS_CACHE_MAX_VALUE_LEN of utils module */
+#define PARAMS_CACHE_SIZE 128
+#define PARAMS_CACHE_MAX_VALUE_LEN 256
+
+/*
+ * Cache is a list of (name, value) tuples, one per position of name-value
+ * pair in FCGI_PARAMS stream since Web-server sends them in the same order
+ * for every request. Value is None if it was too long to be cached.
+ */
+static int
+unpack_cached_pair(PyObject *cache, Py_ssize_t pos, PyObject *names,
+		unsigned char *nbuf, Py_ssize_t nlen, unsigned char *vbuf, Py_ssize_t vlen,
+		PyObject **name, PyObject **value) {
+	PyObject *slot = NULL, *cached, *canonical;
+
+	*name = *value = NULL;
+
+	if (cache && pos < PyList_GET_SIZE(cache)) {
+		slot = PyList_GET_ITEM(cache, pos);
+		cached = PyTuple_GET_ITEM(slot, 0);
+		if (NativeString_EQUALS(cached, nbuf, nlen)) {
+			Py_INCREF(cached);
+			*name = cached;
+			cached = PyTuple_GET_ITEM(slot, 1);
+			if (NativeString_Check(cached) && NativeString_EQUALS(cached, vbuf, vlen)) {
+				Py_INCREF(cached);
+				*value = cached;
+				return 0;
+			}
+		}
+	}
+
+	if (!*name) {
+		*name = NativeString_FromStringAndSize(nbuf, nlen);
+		if (!*name) return -1;
+		if (names) {
+			canonical = PyDict_GetItem(names, *name);
+			if (canonical) {
+				Py_INCREF(canonical);
+				Py_DECREF(*name);
+				*name = canonical;
+			}
+		}
+	}
+
+	*value = NativeString_FromStringAndSize(vbuf, vlen);
+	if (!*value) return -1;
+
+	if (cache && pos < PARAMS_CACHE_SIZE && pos <= PyList_GET_SIZE(cache)) {
+		slot = PyTuple_Pack(2, *name, vlen > PARAMS_CACHE_MAX_VALUE_LEN ? Py_None : *value);
+		if (!slot) return -1;
+		if (pos < PyList_GET_SIZE(cache)) {
+			/* steals reference to slot */
+			PyList_SetItem(cache, pos, slot);
+		} else {
+			if (PyList_Append(cache, slot) < 0) {
+				Py_DECREF(slot);
+				return -1;
+			}
+			Py_DECREF(slot);
+		}
+	}
+
+	return 0;
+}
+
+static int
+parse_len(unsigned char **buf, unsigned char *end, Py_ssize_t *len) {
+	unsigned char *ptr = *buf;
+
+	if (ptr >= end) return -1;
+	if (*ptr & 0x80) {
+		if (end - ptr < 4) return -1;
+		*len = ((ptr[0] & 0x7f) << 24) + (ptr[1] << 16) + (ptr[2] << 8) + ptr[3];
+		*buf = ptr + 4;
+	} else {
+		*len = *ptr;
+		*buf = ptr + 1;
+	}
+	return 0;
+}
+
+/*
+ * Unpack complete name-value pairs found between buf and end into environ.
+ * Stores address of the first byte of incomplete pair (if any) into stop.
+ */
+static int
+unpack_environ_pairs(PyObject *environ, unsigned char *buf, unsigned char *end,
+		PyObject *cache, PyObject *names, Py_ssize_t *pos, unsigned char **stop) {
+	unsigned char *ptr;
+	Py_ssize_t nlen, vlen;
+	PyObject *name, *value;
+	int failed;
+
+	while (buf < end) {
+		ptr = buf;
+		if (parse_len(&ptr, end, &nlen) < 0 || parse_len(&ptr, end, &vlen) < 0 ||
+				end - ptr < nlen + vlen) {
+			break;
+		}
+		failed = unpack_cached_pair(cache, (*pos)++, names, ptr, nlen, ptr + nlen, vlen, &name, &value) < 0 ||
+			PyDict_SetItem(environ, name, value) < 0;
+		Py_XDECREF(name);
+		Py_XDECREF(value);
+		if (failed) return -1;
+		buf = ptr + nlen + vlen;
+	}
+
+	*stop = buf;
+	return 0;
+}
+
+static int
+check_cache_and_names(PyObject **cache, PyObject **names) {
+	if (*cache == Py_None) *cache = NULL;
+	if (*names == Py_None) *names = NULL;
+
+	if ((*cache && !PyList_Check(*cache)) || (*names && !PyDict_Check(*names))) {
+		PyErr_SetString(PyExc_TypeError, "Cache must be a list and names must be a dict");
+		return -1;
+	}
+	return 0;
+}
+
+static PyObject *
+py_unpack_environ(PyObject *self, PyObject *args) {
+	unsigned char *buf, *end, *stop;
+	Py_ssize_t pos = 0;
+	Py_buffer view;
+	PyObject *result, *cache = NULL, *names = NULL;
+
+	#if PY_MAJOR_VERSION >= 3
+	if (!PyArg_ParseTuple(args, "y*|OO:unpack_environ", &view, &cache, &names)) {
+	#else
+	if (!PyArg_ParseTuple(args, "s*|OO:unpack_environ", &view, &cache, &names)) {
+	#endif
+		return NULL;
+	}
+
+	if (check_cache_and_names(&cache, &names) < 0) {
+		PyBuffer_Release(&view);
+		return NULL;
+	}
+
+	buf = (unsigned char *) view.buf;
+	end = buf + view.len;
+	result = PyDict_New();
+
+	if (result) {
+		if (unpack_environ_pairs(result, buf, end, cache, names, &pos, &stop) < 0) {
+			Py_CLEAR(result);
+		} else if (stop < end) {
+			Py_CLEAR(result);
+			PyErr_SetString(PyExc_ValueError, "Buffer is too short");
+		}
+	}
+
+	PyBuffer_Release(&view);
+	return result;
+}
+
+static PyObject *
+py_unpack_environ_into(PyObject *self, PyObject *args) {
+	unsigned char *buf, *stop;
+	Py_ssize_t pos = 0;
+	Py_buffer view;
+	PyObject *environ, *cache = NULL, *names = NULL;
+
+	#if PY_MAJOR_VERSION >= 3
+	if (!PyArg_ParseTuple(args, "O!y*|OOn:unpack_environ_into", &PyDict_Type, &environ, &view, &cache, &names, &pos)) {
+	#else
+	if (!PyArg_ParseTuple(args, "O!s*|OOn:unpack_environ_into", &PyDict_Type, &environ, &view, &cache, &names, &pos)) {
+	#endif
+		return NULL;
+	}
+
+	if (check_cache_and_names(&cache, &names) < 0) {
+		PyBuffer_Release(&view);
+		return NULL;
+	}
+
+	buf = (unsigned char *) view.buf;
+	if (unpack_environ_pairs(environ, buf, buf + view.len, cache, names, &pos, &stop) < 0) {
+		PyBuffer_Release(&view);
+		return NULL;
+	}
+
+	PyBuffer_Release(&view);
+	return Py_BuildValue("(nn)", (Py_ssize_t)(stop - buf), pos);
+}
+
 #define PACK_LEN(len) if (len > 127) { \
 		*ptr++ = 0x80 + ((len >> 24) & 0xff); \
 		*ptr++ = (len >> 16) & 0xff; \
@@ -188,11 +401,96 @@ py_unpack_header(PyObject *self, PyObject *args) {
 }
 
 
+#define FCGI_HEADER_LEN 8
+
+static PyObject *
+make_record(PyObject *record_class, unsigned int record_type, PyObject *content, unsigned int request_id) {
+	PyObject *fields, *record, *item;
+	PyTypeObject *type;
+	Py_ssize_t i;
+
+	/* steals reference to content */
+	fields = Py_BuildValue("(INI)", record_type, content, request_id);
+	if (!fields || record_class == NULL || record_class == Py_None) return fields;
+
+	if (PyType_Check(record_class) && PyType_IsSubtype((PyTypeObject *)record_class, &PyTuple_Type)) {
+		/* same as tuple.__new__(record_class, fields) */
+		type = (PyTypeObject *)record_class;
+		record = type->tp_alloc(type, 3);
+		if (record) {
+			for (i = 0; i < 3; i++) {
+				item = PyTuple_GET_ITEM(fields, i);
+				Py_INCREF(item);
+				PyTuple_SET_ITEM(record, i, item);
+			}
+		}
+	} else {
+		record = PyObject_CallObject(record_class, fields);
+	}
+	Py_DECREF(fields);
+	return record;
+}
+
+static PyObject *
+py_parse_records(PyObject *self, PyObject *args) {
+	PyObject *data, *record_class = NULL, *records, *record, *content;
+	Py_buffer view;
+	Py_ssize_t start, end, content_start, content_len, record_end;
+	unsigned char *header;
+
+	if (!PyArg_ParseTuple(args, "Onn|O:parse_records", &data, &start, &end, &record_class)) return NULL;
+
+	if (PyObject_GetBuffer(data, &view, PyBUF_SIMPLE) < 0) return NULL;
+
+	if (start < 0 || start > end || end > view.len) {
+		PyBuffer_Release(&view);
+		return PyErr_Format(PyExc_ValueError, "Invalid buffer range %zd:%zd", start, end);
+	}
+
+	records = PyList_New(0);
+	if (!records) goto error;
+
+	while (end - start >= FCGI_HEADER_LEN) {
+		header = (unsigned char *)view.buf + start;
+		content_start = start + FCGI_HEADER_LEN;
+		content_len = (header[4] << 8) + header[5];
+		record_end = content_start + content_len + header[6];
+		if (record_end > end) break;
+
+		if (content_len) {
+			content = PySequence_GetSlice(data, content_start, content_start + content_len);
+		} else {
+			content = PyString_FromStringAndSize(NULL, 0);
+		}
+		if (!content) goto error;
+
+		record = make_record(record_class, header[1], content, (header[2] << 8) + header[3]);
+		if (!record) goto error;
+		if (PyList_Append(records, record) < 0) {
+			Py_DECREF(record);
+			goto error;
+		}
+		Py_DECREF(record);
+		start = record_end;
+	}
+
+	PyBuffer_Release(&view);
+	return Py_BuildValue("(Nn)", records, start);
+
+error:
+	Py_XDECREF(records);
+	PyBuffer_Release(&view);
+	return NULL;
+}
+
 static PyMethodDef _methods[] = {
 	{"unpack_pairs", py_unpack_pairs, METH_VARARGS},
+	{"unpack_environ", py_unpack_environ, METH_VARARGS},
+	{"unpack_environ_into", py_unpack_environ_into, METH_VARARGS},
 	{"pack_pair", py_pack_pair, METH_VARARGS},
 	{"pack_header", py_pack_header, METH_VARARGS},
 	{"unpack_header", py_unpack_header, METH_VARARGS},
+	{"parse_records", py_parse_records, METH_VARARGS},
 	{NULL, NULL}
 };
 
@@ -28,7 +28,11 @@ import sys
 
 __all__ = [
     'pack_pairs',
+    'pair_size',
     'unpack_pairs',
+    'unpack_environ',
+    'unpack_environ_into',
+    'parse_records',
 ]
 
 logger = logging.getLogger(__name__)
@@ -49,14 +53,93 @@ for name in 'header', 'begin_request', 'end_request', 'unknown_type':
         __all__.append(full_name)
 
 
+# Names of parameters commonly sent by Web-servers. Environ built by
+# unpack_environ refers to these instead of allocating new strings
+CGI_NAMES = dict((name, name) for name in map(six.moves.intern, (
+    'AUTH_TYPE',
+    'CONTENT_LENGTH',
+    'CONTENT_TYPE',
+    'DOCUMENT_ROOT',
+    'DOCUMENT_URI',
+    'FCGI_ROLE',
+    'GATEWAY_INTERFACE',
+    'HTTPS',
+    'HTTP_ACCEPT',
+    'HTTP_ACCEPT_ENCODING',
+    'HTTP_ACCEPT_LANGUAGE',
+    'HTTP_AUTHORIZATION',
+    'HTTP_CACHE_CONTROL',
+    'HTTP_CONNECTION',
+    'HTTP_CONTENT_LENGTH',
+    'HTTP_CONTENT_TYPE',
+    'HTTP_COOKIE',
+    'HTTP_HOST',
+    'HTTP_ORIGIN',
+    'HTTP_REFERER',
+    'HTTP_USER_AGENT',
+    'HTTP_X_FORWARDED_FOR',
+    'HTTP_X_FORWARDED_PROTO',
+    'HTTP_X_REAL_IP',
+    'HTTP_X_REQUESTED_WITH',
+    'PATH_INFO',
+    'PATH_TRANSLATED',
+    'QUERY_STRING',
+    'REDIRECT_STATUS',
+    'REMOTE_ADDR',
+    'REMOTE_HOST',
+    'REMOTE_PORT',
+    'REMOTE_USER',
+    'REQUEST_METHOD',
+    'REQUEST_SCHEME',
+    'REQUEST_URI',
+    'SCRIPT_FILENAME',
+    'SCRIPT_NAME',
+    'SERVER_ADDR',
+    'SERVER_NAME',
+    'SERVER_PORT',
+    'SERVER_PROTOCOL',
+    'SERVER_SOFTWARE',
+)))
+
+# Maximum number of name-value pairs and length of value cached by
+# unpack_environ
+PARAMS_CACHE_SIZE = 128
+PARAMS_CACHE_MAX_VALUE_LEN = 256
+
+
 def pack_pairs(pairs):
     if isinstance(pairs, dict):
         pairs = six.iteritems(pairs)
     return b''.join(pack_pair(name, value) for name, value in pairs)
 
 
+def pair_size(data):
+    """
+    Return size of name-value pair data starts with or 0 if data is too
+    short to contain name and value lengths
+    """
+    size = 0
+    pos = 0
+    header = bytearray(data[:8])
+    for _ in range(2):
+        if pos >= len(header):
+            return 0
+        if header[pos] & 128:
+            if pos + 4 > len(header):
+                return 0
+            size += 4 + (struct.unpack_from('!L', header, pos)[0]
+                         & 0x7fffffff)
+            pos += 4
+        else:
+            size += 1 + header[pos]
+            pos += 1
+    return size
+
+
 try:
-    from .speedups import pack_pair, unpack_pairs
+    from .speedups import (
+        pack_pair, unpack_pairs, unpack_environ, unpack_environ_into,
+        parse_records)
     logger.debug('Using speedups module')
 except ImportError:
     logger.debug('Failed to load speedups module')
@@ -95,6 +178,8 @@ except ImportError:
         return _len, pos
 
     def unpack_pairs(data):
+        if isinstance(data, memoryview):
+            data = data.tobytes()
         end = len(data)
         pos = 0
         while pos < end:
@@ -112,3 +197,99 @@ except ImportError:
             value = data[pos:pos + value_len]
             pos += value_len
             yield name, value
+
+    if six.PY2:
+        def native_str(s):
+            return s
+    else:
+        def native_str(s):
+            return s.decode("ISO-8859-1")
+
+    def unpack_cached_pair(cache, pos, names, raw_name, raw_value):
+        slot = None
+        if cache is not None and pos < len(cache):
+            slot = cache[pos]
+        if slot is not None and slot[0] == raw_name:
+            name = slot[1]
+            if slot[2] == raw_value:
+                return name, slot[3]
+        else:
+            name = native_str(raw_name)
+            if names is not None:
+                name = names.get(name, name)
+        value = native_str(raw_value)
+        if (cache is not None and pos < PARAMS_CACHE_SIZE
+                and pos <= len(cache)):
+            if len(raw_value) > PARAMS_CACHE_MAX_VALUE_LEN:
+                slot = (raw_name, name, None, None)
+            else:
+                slot = (raw_name, name, raw_value, value)
+            if pos < len(cache):
+                cache[pos] = slot
+            else:
+                cache.append(slot)
+        return name, value
+
+    def unpack_environ_into(environ, data, cache=None, names=None, pos=0):
+        """
+        Unpack complete name-value pairs found in data into environ.
+        Optional cache is a list of pairs found in previously unpacked data
+        at same positions which are reused instead of being decoded again.
+        Optional names dict maps names to their canonical instances.
+        Return number of bytes consumed and position of next pair.
+        """
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        end = len(data)
+        offset = 0
+        while offset < end:
+            try:
+                name_len, start = unpack_len(data, offset)
+                value_len, start = unpack_len(data, start)
+            except (IndexError, struct.error):
+                break
+            value_start = start + name_len
+            offset_next = value_start + value_len
+            if offset_next > end:
+                break
+            name, value = unpack_cached_pair(
+                cache, pos, names, data[start:value_start],
+                data[value_start:offset_next])
+            environ[name] = value
+            offset = offset_next
+            pos += 1
+        return offset, pos
+
+    def unpack_environ(data, cache=None, names=None):
+        """
+        Unpack name-value pairs into dict with native string names and values
+        """
+        environ = {}
+        consumed, _ = unpack_environ_into(environ, data, cache, names)
+        if consumed < len(data):
+            raise ValueError('Buffer is too short')
+        return environ
+
+    def parse_records(data, start, end, record_class=None):
+        """
+        Parse all complete records found in data[start:end].
+        Return list of records along with position of first unparsed byte
+        """
+        records = []
+        while end - start >= header_struct.size:
+            (version, record_type, request_id, content_len,
+             padding) = header_struct.unpack_from(data, start)
+            content_start = start + header_struct.size
+            record_end = content_start + content_len + padding
+            if record_end > end:
+                break
+            if content_len:
+                content = data[content_start:content_start + content_len]
+            else:
+                content = b''
+            if record_class is None:
+                records.append((record_type, content, request_id))
+            else:
+                records.append(record_class(record_type, content, request_id))
+            start = record_end
+        return records, start
@@ -20,8 +20,10 @@
 
 from __future__ import absolute_import
 
+import os
 import six
 import sys
+import stat
 import logging
 from traceback import format_exception
 import re
@@ -30,10 +32,13 @@ from wsgiref.handlers import BaseCGIHandler
 from zope.interface import implementer
 
 from .interfaces import IRequestHandler
+from .const import FCGI_MAX_CONTENT_LEN
+from .base import BodyTooLarge
 from .server import Request, FastCGIServer
 
 
-__all__ = ('WSGIRequestHandler', 'WSGIRefRequestHandler', 'WSGIServer')
+__all__ = ('WSGIRequestHandler', 'WSGIRefRequestHandler', 'WSGIServer',
+           'FileWrapper')
 
 
 logger = logging.getLogger(__name__)
@@ -73,11 +78,33 @@ class WSGIRefRequestHandler(object):
                 exc_info = None
 
 
+class FileWrapper(object):
+    """
+    wsgi.file_wrapper implementation. Regular files are sent by
+    WSGIRequest with os.sendfile, anything else is read in blocks
+    """
+    def __init__(self, filelike, block_size=8192):
+        self.filelike = filelike
+        self.block_size = block_size
+        if hasattr(filelike, 'close'):
+            self.close = filelike.close
+
+    def __iter__(self):
+        read = self.filelike.read
+        block_size = self.block_size
+        while True:
+            data = read(block_size)
+            if not data:
+                break
+            yield data
+
+
 class WSGIRequest(object):
 
     status_pattern = re.compile(r'^[1-5]\d\d .+$')
 
     def __init__(self, fastcgi_request):
+        self._request = fastcgi_request
         self._environ = self.make_environ(fastcgi_request)
         self._stdout = fastcgi_request.stdout
         self._stderr = fastcgi_request.stderr
@@ -95,6 +122,7 @@ class WSGIRequest(object):
         env['wsgi.multithread'] = True
         env['wsgi.multiprocess'] = False
         env['wsgi.run_once'] = False
+        env['wsgi.file_wrapper'] = FileWrapper
 
         https = env.get('HTTPS', '').lower()
         if https in ('yes', 'on', '1'):
@@ -118,6 +146,13 @@ class WSGIRequest(object):
         return self._app_write
 
     def finish(self, app_iter):
+        if isinstance(app_iter, (list, tuple)) and not self._headers_sent:
+            if self._finish_at_once(app_iter):
+                return
+        elif isinstance(app_iter, FileWrapper):
+            if self._send_file(app_iter.filelike):
+                return
+
         if self._headers_sent:
             # _app_write has been already called
             self._stdout.writelines(app_iter)
@@ -138,18 +173,70 @@ class WSGIRequest(object):
         self._stdout.close()
         self._stderr.close()
 
+    def _finish_at_once(self, chunks):
+        """
+        Send response headers and body, EOF marks of output streams and
+        FCGI_END_REQUEST with single write if whole response fits one record
+        """
+        # text chunks are encoded to as many bytes as there are characters
+        size = sum(len(chunk) for chunk in chunks)
+        if size > FCGI_MAX_CONTENT_LEN:
+            return False
+        if not any(name.lower() == 'content-length'
+                   for name, _ in self._headers):
+            self._headers.append(('Content-Length', str(size)))
+        header_block = self._header_block()
+        if len(header_block) + size > FCGI_MAX_CONTENT_LEN:
+            return False
+        output = header_block + b''.join(
+            chunk.encode("ISO-8859-1")
+            if isinstance(chunk, six.text_type) else chunk
+            for chunk in chunks)
+        self._headers_sent = True
+        self._request.end(output=output)
+        return True
+
+    def _send_file(self, filelike):
+        """
+        Send rest of regular file with os.sendfile, return False if it's not
+        a regular file
+        """
+        try:
+            fd = filelike.fileno()
+            st = os.fstat(fd)
+            if not stat.S_ISREG(st.st_mode):
+                return False
+            offset = filelike.tell()
+        except (AttributeError, EnvironmentError, ValueError):
+            return False
+
+        count = max(st.st_size - offset, 0)
+        if not self._headers_sent:
+            if not any(name.lower() == 'content-length'
+                       for name, _ in self._headers):
+                self._headers.append(('Content-Length', str(count)))
+            self._send_headers()
+        self._stdout.send_file(fd, offset, count)
+        filelike.seek(offset + count)
+        self._stdout.close()
+        self._stderr.close()
+        return True
+
     def _app_write(self, chunk):
         if not self._headers_sent:
             self._send_headers()
         self._stdout.write(chunk)
 
     def _send_headers(self):
+        self._stdout.write(self._header_block())
+        self._headers_sent = True
+
+    def _header_block(self):
         headers = ['Status: {0}\r\n'.format(self._status)]
         headers.extend(('{0}: {1}\r\n'.format(name, value)
                        for name, value in self._headers))
         headers.append('\r\n')
-        self._stdout.writelines(headers)
-        self._headers_sent = True
+        return ''.join(headers).encode("ISO-8859-1")
 
 @implementer(IRequestHandler)
 class WSGIRequestHandler(object):
@@ -163,6 +250,12 @@ class WSGIRequestHandler(object):
             request.finish(app_iter)
             if hasattr(app_iter, 'close'):
                 app_iter.close()
+        except BodyTooLarge:
+            if request._headers_sent:
+                raise
+            logger.warning('Request body is too large')
+            request.start_response('413 Request Entity Too Large', [])
+            request.finish([])
         except Exception:
             exc_info = sys.exc_info()
             try:
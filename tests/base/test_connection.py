@@ -2,6 +2,9 @@ from __future__ import absolute_import, with_statement
 
 import unittest
 from random import randint
+from tempfile import TemporaryFile
+
+from gevent import socket, spawn
 
 from gevent_fastcgi.const import (
     FCGI_STDIN,
@@ -58,3 +61,92 @@ class ConnectionTests(unittest.TestCase):
         self.sock.flip()
 
         self.assertRaises(PartialRead, conn.read_record)
+
+    def test_read_records_larger_than_buffer(self):
+        data = [binary_data(FCGI_MAX_CONTENT_LEN, 1) for _ in range(7)]
+        conn = Connection(self.sock, buffer_size=64)
+        for chunk in data:
+            conn.write_record(Record(FCGI_STDIN, chunk, 1))
+
+        self.sock.flip()
+
+        # content read earlier must stay intact after buffer is compacted
+        received = list(conn)
+        assert [record.content for record in received] == data
+        assert all(isinstance(record.content, memoryview)
+                   for record in received)
+
+    def test_received(self):
+        conn = Connection(self.sock)
+        records = [Record(FCGI_STDIN, binary_data(), 1) for _ in range(3)]
+        conn.write_records(records)
+        self.sock.flip()
+
+        assert not conn.received()
+        received = iter(conn)
+        # all records arrive at once
+        assert next(received) == records[0]
+        assert conn.received()
+        assert list(received) == records[1:]
+        assert not conn.received()
+
+    def test_send_file(self):
+        data = binary_data(FCGI_MAX_CONTENT_LEN * 2 + 100)
+        offset = 50
+        with TemporaryFile() as f:
+            f.write(data)
+            f.flush()
+            fd = f.fileno()
+
+            # MockSocket has no fileno so data is read in userspace
+            conn = Connection(self.sock)
+            conn.send_file(FCGI_STDOUT, 1, fd, offset, len(data) - offset)
+            self.sock.flip()
+            records = list(conn)
+            assert len(records) == 3
+            assert b''.join(r.content for r in records) == data[offset:]
+
+            # real socket goes with os.sendfile
+            sock, peer = socket.socketpair()
+            try:
+                conn = Connection(sock)
+                peer_conn = Connection(peer)
+                sender = spawn(conn.send_file, FCGI_STDOUT, 1, fd, offset,
+                               len(data) - offset)
+                received = []
+                while sum(map(len, received)) < len(data) - offset:
+                    received.append(peer_conn.read_record().content.tobytes())
+                sender.get(timeout=1)
+                assert b''.join(received) == data[offset:]
+            finally:
+                sock.close()
+                peer.close()
+
+    def test_write_record_without_record(self):
+        conn = Connection(self.sock)
+        conn.write_record(FCGI_STDOUT, 3, b'content')
+        conn.write_record(Record(FCGI_STDERR, b'', 3))
+
+        self.sock.flip()
+
+        assert list(conn) == [
+            Record(FCGI_STDOUT, b'content', 3),
+            Record(FCGI_STDERR, b'', 3),
+        ]
+        assert not hasattr(Record(FCGI_STDOUT, b'', 3), '__dict__')
+
+    def test_write_records(self):
+        records = [Record(FCGI_STDOUT, binary_data(137, 1), request_id)
+                   for request_id in range(1, 14)]
+        records.append(Record(FCGI_STDOUT, b'', 13))
+        # force partial sends
+        self.sock.max_send = 13
+        conn = Connection(self.sock)
+        conn.write_records(records)
+
+        # records are 8-byte aligned
+        assert len(self.sock.output) % 8 == 0
+
+        self.sock.flip()
+
+        assert list(conn) == records
@@ -1,11 +1,16 @@
 from __future__ import absolute_import, with_statement
 
+import shutil
+import threading
+import tempfile
 import unittest
+import mock
 from six.moves import xrange
 
-from gevent import Timeout
+from gevent import Timeout, spawn, sleep
 
-from gevent_fastcgi.base import Connection, InputStream
+from gevent_fastcgi.base import (
+    Connection, InputStream, MemoryBudget, SpooledFile)
 from ..utils import binary_data, text_data, MockSocket
 
 
@@ -64,3 +69,215 @@ class InputStreamTests(unittest.TestCase):
         data_out = stream.readlines()
         data_out = [line.decode("ISO-8859-1") for line in data_out]
         assert data_out == data_in, data_out
+
+    def test_spooling(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            for options in (
+                {},
+                {'spool_dir': tmp_dir},
+                {'offload': True},
+            ):
+                stream = InputStream(max_mem=100, **options)
+                data_in = [binary_data(30) for _ in range(5)]
+                for chunk in data_in:
+                    stream.feed(chunk)
+                assert stream._file.rolled
+                stream.feed('')
+
+                assert stream.read() == b''.join(data_in)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_no_spooling(self):
+        stream = InputStream(max_mem=100)
+        stream.feed(binary_data(100))
+        stream.feed('')
+        assert not stream._file.rolled
+
+    def test_memory_budget(self):
+        budget = MemoryBudget(250)
+        small, large = [InputStream(max_mem=200, budget=budget)
+                        for _ in range(2)]
+        small_data = binary_data(50)
+        large_data = [binary_data(100) for _ in range(2)]
+        small.feed(small_data)
+        for chunk in large_data:
+            large.feed(chunk)
+        assert budget.usage == 250
+
+        third = InputStream(max_mem=200, budget=budget)
+        third_data = binary_data(100)
+        third.feed(third_data)
+        # largest stream is spooled to make room for the new one
+        assert large._file.rolled
+        assert not small._file.rolled
+        assert not third._file.rolled
+        assert budget.usage == 150
+
+        for stream, data in ((small, small_data),
+                             (large, b''.join(large_data)),
+                             (third, third_data)):
+            stream.feed('')
+            assert stream.read() == data
+            stream._file.close()
+        assert budget.usage == 0
+
+    def test_memory_budget_offload(self):
+        budget = MemoryBudget(250)
+        hub_thread = threading.current_thread()
+        budget_threads = []
+        rollover_threads = []
+
+        def record_thread(threads, method):
+            def wrapper(*args):
+                threads.append(threading.current_thread())
+                return method(*args)
+            return wrapper
+
+        budget.allocate = record_thread(budget_threads, budget.allocate)
+        budget.release = record_thread(budget_threads, budget.release)
+        rollover = record_thread(rollover_threads, SpooledFile._rollover)
+        with mock.patch.object(SpooledFile, '_rollover', rollover):
+            small, large = [
+                InputStream(max_mem=200, offload=True, budget=budget)
+                for _ in range(2)]
+            small.feed(binary_data(50))
+            large.feed(binary_data(200))
+            # largest stream is spooled to make room
+            small.feed(binary_data(100))
+            assert large._file.rolled
+            assert budget.usage == 150
+            # stream over its own limit is spooled too
+            small.feed(binary_data(100))
+            assert small._file.rolled
+            assert budget.usage == 0
+
+        # files are spooled in threadpool, budget is updated in hub thread
+        assert len(rollover_threads) == 2
+        assert hub_thread not in rollover_threads
+        assert budget_threads
+        assert all(thread is hub_thread for thread in budget_threads)
+
+    def test_offloaded_tell(self):
+        spooled = SpooledFile(max_mem=10, offload=True)
+        spooled.write(binary_data(20, 20))
+        spooled.read(5)
+        writing = threading.Event()
+        written = threading.Event()
+
+        class BlockingFile(object):
+
+            def __init__(self, file):
+                self._file = file
+
+            def __getattr__(self, name):
+                return getattr(self._file, name)
+
+            def write(self, data):
+                writing.set()
+                written.wait()
+                return self._file.write(data)
+
+        spooled._file = BlockingFile(spooled._file)
+        writer = spawn(spooled.write, binary_data(20, 20))
+        while not writing.is_set():
+            sleep(0.01)
+        # position is not read until offloaded write is done
+        reader = spawn(spooled.tell)
+        sleep(0.1)
+        assert not reader.ready()
+        written.set()
+        writer.get()
+        assert reader.get() == 5
+
+    def test_streaming(self):
+        for options in (
+            {},
+            {'max_mem': 10},
+            {'max_mem': 10, 'offload': True},
+        ):
+            stream = InputStream(streaming=True, **options)
+            stream.feed(b'first line\nsec')
+            assert stream.readline() == b'first line\n'
+            assert stream.read(2) == b'se'
+
+            reader = spawn(stream.readline)
+            sleep(0)
+            assert not reader.ready()
+            stream.feed(b'ond line\nthird')
+            assert reader.get(timeout=1) == b'cond line\n'
+
+            buf = bytearray(10)
+            assert stream.readinto(buf) == 5
+            assert bytes(buf[:5]) == b'third'
+
+            reader = spawn(stream.read, 10)
+            stream.feed(b' line')
+            sleep(0)
+            assert not reader.ready()
+            stream.feed('')
+            assert reader.get(timeout=1) == b' line'
+            assert stream.readinto(buf) == 0
+            assert stream.read() == b''
+
+    def test_not_streaming(self):
+        stream = InputStream()
+        stream.feed(b'first line\n')
+        with Timeout(0.01, False):
+            stream.readline()
+            raise AssertionError('Read returned before EOF')
+        stream.feed('')
+        buf = bytearray(20)
+        assert stream.readinto(buf) == 11
+
+    def test_high_water_mark(self):
+        stream = InputStream(streaming=True, high_water_mark=100)
+        stream.feed(binary_data(100))
+        stream.wait_drained()
+
+        stream.feed(binary_data(100))
+        feeder = spawn(stream.wait_drained)
+        sleep(0)
+        assert not feeder.ready()
+        stream.read(50)
+        sleep(0)
+        # still more than half of high water mark unread
+        assert not feeder.ready()
+        stream.read(100)
+        feeder.join(timeout=1)
+        assert feeder.ready()
+
+        stream.feed(binary_data(100))
+        feeder = spawn(stream.wait_drained)
+        sleep(0)
+        assert not feeder.ready()
+        stream.resume()
+        feeder.join(timeout=1)
+        assert feeder.ready()
+
+    def test_discard(self):
+        stream = InputStream(max_mem=10)
+        stream.feed(binary_data(100))
+        stream.discard()
+        assert stream.discarded
+        stream.feed(binary_data(100))
+        assert stream.unread == 0
+        stream.feed('')
+        assert stream.eof_received
+        assert stream.read() == b''
+
+    def test_close(self):
+        budget = MemoryBudget(1000)
+        stream = InputStream(budget=budget)
+        stream.pump = lambda: False
+        stream.feed(binary_data(100))
+        stream.close()
+        assert budget.usage == 0
+        assert stream.pump is None
+        self.assertRaises(ValueError, stream.read)
+        stream.feed('')
+        assert stream.eof_received
+
+    def test_slots(self):
+        assert not hasattr(self.stream, '__dict__')
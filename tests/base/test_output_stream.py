@@ -1,6 +1,8 @@
 from __future__ import absolute_import, with_statement
 
 import unittest
+import mock
+from array import array
 from random import randint
 
 from gevent import sleep, Timeout
@@ -44,6 +46,7 @@ class StreamTestsBase(object):
         assert stream.request_id == 333
         assert stream.record_type == self.stream_class.record_type
         assert not stream.closed
+        assert not hasattr(stream, '__dict__')
 
     def test_write(self):
         stream = self.stream()
@@ -89,6 +92,32 @@ class StreamTestsBase(object):
             received.append(record.content)
         assert b''.join(received) == b''.join(data)
 
+    def test_writelines_buffer_types(self):
+        stream = self.stream()
+        words = array('H', range(1000))
+        data = [
+            binary_data(FCGI_MAX_CONTENT_LEN * 2 + 7),
+            b'small',
+            bytearray(binary_data(137)),
+            memoryview(binary_data(FCGI_MAX_CONTENT_LEN)),
+            memoryview(words),
+        ]
+        expected = b''.join(
+            bytes(chunk) if not isinstance(chunk, memoryview)
+            else chunk.tobytes() for chunk in data)
+
+        for lines in data, iter(data):
+            self.sock.output = b''
+            stream.writelines(lines)
+
+            self.sock.flip()
+            received = []
+            for record in self.conn:
+                assert record.type == stream.record_type
+                assert len(record.content) <= FCGI_MAX_CONTENT_LEN
+                received.append(bytes(record.content))
+            assert b''.join(received) == expected
+
     def test_empty_write(self):
         conn = self.conn
         # calling this would raise AttributeError
@@ -155,3 +184,102 @@ class StderrStreamTests(StreamTestsBase, unittest.TestCase):
                                and record.request_id == stream.request_id))
 
         assert data_in == data_out.decode("ISO-8859-1")
+
+    def test_writelines_no_copy(self):
+        stream = self.stream()
+        self.conn.write_records = mock.Mock()
+        small = [b'a', b'b', b'c']
+        large = binary_data(FCGI_MAX_CONTENT_LEN + 1)
+
+        stream.writelines(small + [large])
+
+        records = self.conn.write_records.call_args[0][0]
+        assert len(records) == 2
+        # small lines are gathered as they are
+        assert records[0].content[:3] == small
+        # large one is sliced
+        assert isinstance(records[0].content[3], memoryview)
+        assert all(isinstance(buf, memoryview) for buf in records[1].content)
+        assert sum(record.content_len for record in records) == len(
+            large) + 3
+
+
+class BufferedStdoutStreamTests(StdoutStreamTests):
+
+    def stream(self, conn=None, request_id=None, buffer_size=1024,
+               flush_delay=None):
+        if conn is None:
+            conn = self.conn
+        if request_id is None:
+            request_id = randint(1, 65535)
+        return self.stream_class(conn, request_id, buffer_size, flush_delay)
+
+    def test_write(self):
+        stream = self.stream()
+        data = [binary_data(1024, 1) for _ in range(13)]
+
+        list(map(stream.write, data))
+        stream.flush()
+
+        self.sock.flip()
+
+        received = []
+        for record in self.conn:
+            assert record.type == stream.record_type
+            assert record.request_id == stream.request_id
+            assert len(record.content) <= 1024
+            received.append(record.content)
+        assert b''.join(received) == b''.join(data)
+
+    def test_buffer_size(self):
+        for buffer_size in (0, -1, FCGI_MAX_CONTENT_LEN + 1):
+            with self.assertRaises(ValueError):
+                self.stream(buffer_size=buffer_size)
+
+    def test_coalesce(self):
+        stream = self.stream(flush_delay=10)
+        data = [binary_data(20, 1) for _ in range(13)]
+
+        stream.writelines(iter(data))
+        # nothing is sent before buffer is flushed
+        assert not self.sock.output
+        stream.close()
+
+        self.sock.flip()
+
+        records = list(self.conn)
+        assert len(records) == 2
+        assert records[0].content == b''.join(data)
+        assert records[1].content == b''
+
+    def test_flush_on_threshold(self):
+        stream = self.stream(buffer_size=100, flush_delay=10)
+        data = [binary_data(30) for _ in range(7)]
+
+        list(map(stream.write, data))
+
+        self.sock.flip()
+
+        contents = [record.content for record in self.conn]
+        assert contents == [b''.join(data[:3]), b''.join(data[3:6])]
+
+    def test_flush_on_timer(self):
+        stream = self.stream(flush_delay=0.01)
+        data = binary_data(137)
+        stream.write(data)
+        assert not self.sock.output
+        sleep(0.1)
+
+        self.sock.flip()
+
+        assert [record.content for record in self.conn] == [data]
+
+    def test_flush(self):
+        stream = self.stream(flush_delay=10)
+        data = binary_data(137)
+        stream.write(data)
+        stream.flush()
+
+        self.sock.flip()
+
+        assert [record.content for record in self.conn] == [data]
@@ -2,10 +2,12 @@ from __future__ import absolute_import
 
 import sys
 import imp
+import six
 import unittest
 from itertools import product
 
-from gevent_fastcgi.utils import pack_pairs, unpack_pairs
+from gevent_fastcgi.const import FCGI_STDIN, FCGI_PARAMS
+from gevent_fastcgi.utils import pack_pairs, unpack_pairs, pack_header
 
 
 SHORT_STR = b'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'
@@ -29,6 +31,111 @@ class UtilsTests(unittest.TestCase):
             with self.assertRaises(ValueError):
                 pack_pairs((pair,))
 
+    def test_unpack_environ(self):
+        from gevent_fastcgi.utils import unpack_environ
+
+        pairs = dict(
+            (name + str(i).encode(), value) for i, (name, value) in enumerate(
+                product((b'HTTP_X', b'PATH_INFO'), STRINGS + (b'/\xe9t\xe9',))))
+        if six.PY2:
+            environ = pairs
+        else:
+            environ = dict(
+                (name.decode("ISO-8859-1"), value.decode("ISO-8859-1"))
+                for name, value in pairs.items())
+        packed = pack_pairs(pairs)
+
+        assert unpack_environ(packed) == environ
+        assert unpack_environ(memoryview(bytearray(packed))) == environ
+        with self.assertRaises(ValueError):
+            unpack_environ(packed[:-1])
+
+    def test_unpack_environ_cache(self):
+        from gevent_fastcgi.utils import unpack_environ, CGI_NAMES
+
+        long_value = b'x' * 1024
+        cache = []
+        first = unpack_environ(pack_pairs((
+            (b'REQUEST_METHOD', b'GET'),
+            (b'HTTP_X_CUSTOM', b'abc'),
+            (b'HTTP_COOKIE', long_value),
+        )), cache, CGI_NAMES)
+        second = unpack_environ(pack_pairs((
+            (b'REQUEST_METHOD', b'POST'),
+            (b'HTTP_X_CUSTOM', b'abc'),
+            (b'HTTP_COOKIE', long_value),
+        )), cache, CGI_NAMES)
+
+        assert len(cache) == 3
+        assert second == {
+            'REQUEST_METHOD': 'POST',
+            'HTTP_X_CUSTOM': 'abc',
+            'HTTP_COOKIE': long_value.decode("ISO-8859-1"),
+        }
+        names = dict((name, name) for name in second)
+        # known names are shared
+        assert names['REQUEST_METHOD'] is CGI_NAMES['REQUEST_METHOD']
+        # repeated names and short values are reused
+        assert names['HTTP_X_CUSTOM'] is [
+            name for name in first if name == 'HTTP_X_CUSTOM'][0]
+        assert second['HTTP_X_CUSTOM'] is first['HTTP_X_CUSTOM']
+        assert second['HTTP_COOKIE'] is not first['HTTP_COOKIE']
+
+    def test_unpack_environ_into(self):
+        from gevent_fastcgi.utils import unpack_environ_into
+
+        pairs = ((b'PATH_INFO', MEDIUM_STR), (b'QUERY_STRING', SHORT_STR))
+        packed = pack_pairs(pairs)
+        environ = {}
+        cache = []
+        pos = 0
+        tail = b''
+        # feed data in chunks splitting pairs between them
+        for i in range(0, len(packed), 7):
+            data = tail + packed[i:i + 7]
+            consumed, pos = unpack_environ_into(
+                environ, data, cache, None, pos)
+            tail = data[consumed:]
+
+        assert tail == b''
+        assert pos == 2
+        assert sorted(environ) == ['PATH_INFO', 'QUERY_STRING']
+        assert environ['PATH_INFO'].encode("ISO-8859-1") == MEDIUM_STR
+
+    def test_pair_size(self):
+        from gevent_fastcgi.utils import pair_size
+
+        for name, value in product(STRINGS, STRINGS):
+            packed = pack_pairs(((name, value),))
+            assert pair_size(packed) == len(packed)
+            assert pair_size(memoryview(packed)[:8]) == len(packed)
+        # name and value lengths are incomplete
+        assert pair_size(b'') == 0
+        assert pair_size(pack_pairs(((SHORT_STR, LONG_STR),))[:4]) == 0
+
+    def test_parse_records(self):
+        from gevent_fastcgi.utils import parse_records
+
+        data = b''.join((
+            pack_header(1, FCGI_PARAMS, 1, len(SHORT_STR), 2), SHORT_STR,
+            b'\x00\x00',
+            pack_header(1, FCGI_STDIN, 2, 0, 0),
+            pack_header(1, FCGI_STDIN, 3, len(MEDIUM_STR), 0), MEDIUM_STR,
+        ))
+        partial = pack_header(1, FCGI_STDIN, 4, len(SHORT_STR), 0)
+        view = memoryview(data + partial + SHORT_STR[:-1])
+
+        records, pos = parse_records(view, 0, len(view))
+        assert records == [
+            (FCGI_PARAMS, SHORT_STR, 1),
+            (FCGI_STDIN, b'', 2),
+            (FCGI_STDIN, MEDIUM_STR, 3),
+        ]
+        assert pos == len(data)
+        assert isinstance(records[0][1], memoryview)
+
+        assert parse_records(view, pos, len(view)) == ([], pos)
+
 
 class NoSpeedupsUtilsTests(UtilsTests):
     """
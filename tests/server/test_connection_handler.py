@@ -1,10 +1,11 @@
 from __future__ import absolute_import
 
+import gc
 import unittest
 import mock
 from itertools import count
 
-from gevent import sleep, spawn, event
+from gevent import sleep, spawn, event, getcurrent, socket
 
 from gevent_fastcgi.const import (
     FCGI_RESPONDER,
@@ -28,7 +29,7 @@ from gevent_fastcgi.const import (
     FCGI_STDERR,
     FCGI_DATA,
 )
-from gevent_fastcgi.base import InputStream, Record
+from gevent_fastcgi.base import Connection, InputStream, Record, BodyTooLarge
 from gevent_fastcgi.utils import (
     pack_begin_request,
     pack_pairs,
@@ -36,8 +37,8 @@ from gevent_fastcgi.utils import (
     unpack_end_request,
     unpack_unknown_type,
 )
-from gevent_fastcgi.server import ConnectionHandler, ServerConnection
-from ..utils import pack_env
+from gevent_fastcgi.server import ConnectionHandler, ServerConnection, logger
+from ..utils import pack_env, binary_data, text_data
 
 
 class ConnectionHandlerTests(unittest.TestCase):
@@ -114,6 +115,71 @@ class ConnectionHandlerTests(unittest.TestCase):
         for stream in FCGI_STDOUT, FCGI_STDERR:
             assert b'' == read_stream(handler, stream, req_id)
 
+    def test_split_params(self):
+        req_id = next_req_id()
+        role = FCGI_RESPONDER
+        env = pack_env(PATH_INFO='/some/path', QUERY_STRING='a=1')
+        cut = len(env) // 2
+        records = (
+            (FCGI_BEGIN_REQUEST, pack_begin_request(role, 0), req_id),
+            (FCGI_PARAMS, env[:cut], req_id),
+            (FCGI_PARAMS, env[cut:], req_id),
+            (FCGI_PARAMS, '', req_id),
+        )
+
+        handler = run_handler(records, role=role)
+
+        assert handler.request_handler.call_count == 1
+        request = handler.request_handler.call_args[0][0]
+        assert request.environ['PATH_INFO'] == '/some/path'
+        assert request.environ['QUERY_STRING'] == 'a=1'
+        assert len(request.environ) == len(list(unpack_pairs(env)))
+
+    def test_params_split_into_many_records(self):
+        req_id = next_req_id()
+        role = FCGI_RESPONDER
+        cookie = text_data(5000)
+        env = pack_env(HTTP_COOKIE=cookie, QUERY_STRING='a=1')
+        # lengths of pairs are split too
+        records = [(FCGI_BEGIN_REQUEST, pack_begin_request(role, 0), req_id)]
+        records.extend((FCGI_PARAMS, env[pos:pos + 3], req_id)
+                       for pos in range(0, len(env), 3))
+        records.append((FCGI_PARAMS, '', req_id))
+
+        handler = run_handler(records, role=role)
+
+        assert handler.request_handler.call_count == 1
+        request = handler.request_handler.call_args[0][0]
+        assert request.environ['HTTP_COOKIE'] == cookie
+        assert request.environ['QUERY_STRING'] == 'a=1'
+        assert len(request.environ) == len(list(unpack_pairs(env)))
+
+    def test_pair_split_inside_lengths_and_value(self):
+        req_id = next_req_id()
+        role = FCGI_RESPONDER
+        cookie = text_data(1000, 1000)
+        env = pack_pairs([('HTTP_COOKIE', cookie)]) + pack_env()
+        # first cut falls between bytes of 4-byte value length, the others
+        # in the middle of value
+        cuts = (0, 3, 8, 500, len(env))
+        buf = bytearray(len(env))
+
+        def records():
+            yield FCGI_BEGIN_REQUEST, pack_begin_request(role, 0), req_id
+            for start, end in zip(cuts, cuts[1:]):
+                # content refers to buffer reused for the next record like
+                # the one records are received into
+                buf[:end - start] = env[start:end]
+                yield FCGI_PARAMS, memoryview(buf)[:end - start], req_id
+            yield FCGI_PARAMS, '', req_id
+
+        handler = run_handler(records(), role=role)
+
+        assert handler.request_handler.call_count == 1
+        request = handler.request_handler.call_args[0][0]
+        assert request.environ['HTTP_COOKIE'] == cookie
+        assert len(request.environ) == len(list(unpack_pairs(env)))
+
     def test_abort_request(self):
         req_id = next_req_id()
         role = FCGI_RESPONDER
@@ -171,6 +237,293 @@ class ConnectionHandlerTests(unittest.TestCase):
             for stream in FCGI_STDOUT, FCGI_STDERR:
                 assert b'' == read_stream(handler, stream, r_id)
 
+    def test_stdin_high_water_mark(self):
+        req_id = next_req_id()
+        role = FCGI_RESPONDER
+        chunks = [binary_data(100) for _ in range(10)]
+        records = [
+            (FCGI_BEGIN_REQUEST, pack_begin_request(role, 0), req_id),
+            (FCGI_PARAMS, pack_env(), req_id),
+            (FCGI_PARAMS, '', req_id),
+        ]
+        records.extend((FCGI_STDIN, chunk, req_id) for chunk in chunks)
+        records.append((FCGI_STDIN, '', req_id))
+        max_unread = []
+
+        def slow_reader(request):
+            stdin = request.stdin
+            while True:
+                max_unread.append(stdin.unread)
+                data = stdin.read(50)
+                if not data:
+                    break
+                request.stdout.write(data)
+                sleep(0.001)
+
+        handler = run_handler(records, role=role, request_handler=slow_reader,
+                              stdin_options=dict(
+                                  streaming=True, high_water_mark=200))
+
+        assert read_stream(handler, FCGI_STDOUT, req_id) == b''.join(chunks)
+        # reading stops once unread data goes over high water mark
+        assert max(max_unread) <= 300
+
+    def test_discard_input_of_ended_request(self):
+        req_id = next_req_id()
+        req_id_2 = next_req_id()
+        role = FCGI_RESPONDER
+        flags = FCGI_KEEP_CONN
+        records = (
+            (FCGI_BEGIN_REQUEST, pack_begin_request(role, flags), req_id),
+            (FCGI_PARAMS, pack_env(), req_id),
+            (FCGI_PARAMS, '', req_id),
+            # let request handler end request before its body is received
+            0.1,
+            (FCGI_STDIN, binary_data(), req_id),
+            (FCGI_STDIN, '', req_id),
+            (FCGI_BEGIN_REQUEST, pack_begin_request(role, flags), req_id_2),
+            (FCGI_PARAMS, pack_env(), req_id_2),
+            (FCGI_PARAMS, '', req_id_2),
+            (FCGI_STDIN, '', req_id_2),
+        )
+
+        handler = run_handler(records, role=role)
+
+        assert handler.request_handler.call_count == 2
+        request = handler.request_handler.call_args_list[0][0][0]
+        assert request.stdin.discarded
+        assert request.stdin.unread == 0
+        assert not handler.discarded
+        for r_id in req_id, req_id_2:
+            rec = find_rec(handler, FCGI_END_REQUEST, r_id)
+            assert rec and unpack_end_request(rec.content)
+
+    def test_content_length_too_large(self):
+        req_id = next_req_id()
+        role = FCGI_RESPONDER
+        records = (
+            (FCGI_BEGIN_REQUEST, pack_begin_request(role, 0), req_id),
+            (FCGI_PARAMS, pack_env(CONTENT_LENGTH='1000'), req_id),
+            (FCGI_PARAMS, '', req_id),
+            (FCGI_STDIN, binary_data(1000), req_id),
+            (FCGI_STDIN, '', req_id),
+        )
+
+        handler = run_handler(records, role=role, max_body_size=100)
+
+        assert not handler.request_handler.called
+        assert not handler.requests
+        assert read_stream(handler, FCGI_STDOUT, req_id).startswith(
+            b'Status: 413 ')
+        rec = find_rec(handler, FCGI_END_REQUEST, req_id)
+        assert rec and unpack_end_request(rec.content)
+
+    def test_body_too_large(self):
+        req_id = next_req_id()
+        role = FCGI_RESPONDER
+        records = [
+            (FCGI_BEGIN_REQUEST, pack_begin_request(role, 0), req_id),
+            (FCGI_PARAMS, pack_env(), req_id),
+            (FCGI_PARAMS, '', req_id),
+        ]
+        records.extend((FCGI_STDIN, binary_data(60), req_id)
+                       for _ in range(3))
+        records.append((FCGI_STDIN, '', req_id))
+        errors = []
+
+        def request_handler(request):
+            try:
+                request.stdin.read()
+            except BodyTooLarge as e:
+                errors.append((e, request.stdin.size))
+
+        handler = run_handler(records, role=role,
+                              request_handler=request_handler,
+                              max_body_size=100)
+
+        assert len(errors) == 1
+        # nothing is kept once body turns out too large
+        assert errors[0][1] == 0
+        assert not handler.requests
+        rec = find_rec(handler, FCGI_END_REQUEST, req_id)
+        assert rec and unpack_end_request(rec.content)
+
+    def test_inline_request(self):
+        req_id = next_req_id()
+        role = FCGI_RESPONDER
+        data = binary_data()
+        records = (
+            (FCGI_BEGIN_REQUEST, pack_begin_request(role, FCGI_KEEP_CONN),
+             req_id),
+            (FCGI_PARAMS, pack_env(), req_id),
+            (FCGI_PARAMS, '', req_id),
+            (FCGI_STDIN, data, req_id),
+            (FCGI_STDIN, '', req_id),
+        )
+        greenlets = []
+
+        def request_handler(request):
+            greenlets.append(getcurrent())
+            copy_stdin_to_stdout(request)
+
+        handler = run_handler(records, role=role,
+                              request_handler=request_handler)
+
+        # request is handled in connection greenlet
+        assert greenlets == [handler._greenlet]
+        assert handler._reader is None
+        assert read_stream(handler, FCGI_STDOUT, req_id) == data
+        assert handler.conn.close.called
+
+    def test_inline_request_without_keep_conn(self):
+        req_id = next_req_id()
+        role = FCGI_RESPONDER
+        data = binary_data()
+        records = (
+            (FCGI_BEGIN_REQUEST, pack_begin_request(role, 0), req_id),
+            (FCGI_PARAMS, pack_env(), req_id),
+            (FCGI_PARAMS, '', req_id),
+            (FCGI_STDIN, data, req_id),
+            (FCGI_STDIN, '', req_id),
+        )
+        greenlets = []
+
+        def request_handler(request):
+            greenlets.append(getcurrent())
+            copy_stdin_to_stdout(request)
+
+        handler = run_handler(records, role=role,
+                              request_handler=request_handler)
+
+        # single request of connection is handled in connection greenlet
+        # which closes it once request is done
+        assert greenlets == [handler._greenlet]
+        assert handler._reader is None
+        assert not handler.requests
+        assert read_stream(handler, FCGI_STDOUT, req_id) == data
+        rec = find_rec(handler, FCGI_END_REQUEST, req_id)
+        assert rec and unpack_end_request(rec.content)
+        assert handler.conn.close.called
+
+    def test_inline_request_abort(self):
+        req_id = next_req_id()
+        role = FCGI_RESPONDER
+        records = (
+            (FCGI_BEGIN_REQUEST, pack_begin_request(role, FCGI_KEEP_CONN),
+             req_id),
+            (FCGI_PARAMS, pack_env(), req_id),
+            (FCGI_PARAMS, '', req_id),
+            (FCGI_ABORT_REQUEST, '', req_id),
+        )
+
+        handler = run_handler(records, role=role,
+                              request_handler=copy_stdin_to_stdout)
+
+        assert handler._reader is None
+        assert not handler.requests
+        rec = find_rec(handler, FCGI_END_REQUEST, req_id)
+        assert rec and unpack_end_request(rec.content)
+
+    def test_inline_request_fallback(self):
+        req_id = next_req_id()
+        req_id_2 = next_req_id()
+        role = FCGI_RESPONDER
+        flags = FCGI_KEEP_CONN
+        data = binary_data()
+        data_2 = binary_data()
+        records = (
+            (FCGI_BEGIN_REQUEST, pack_begin_request(role, flags), req_id),
+            (FCGI_PARAMS, pack_env(), req_id),
+            (FCGI_PARAMS, '', req_id),
+            # first request waits for input when second one begins
+            (FCGI_BEGIN_REQUEST, pack_begin_request(role, flags), req_id_2),
+            (FCGI_PARAMS, pack_env(), req_id_2),
+            (FCGI_PARAMS, '', req_id_2),
+            (FCGI_STDIN, data_2, req_id_2),
+            (FCGI_STDIN, '', req_id_2),
+            (FCGI_STDIN, data, req_id),
+            (FCGI_STDIN, '', req_id),
+        )
+        greenlets = []
+
+        def request_handler(request):
+            greenlets.append(getcurrent())
+            copy_stdin_to_stdout(request)
+
+        handler = run_handler(records, role=role,
+                              request_handler=request_handler)
+
+        assert handler._reader is not None
+        assert greenlets[0] is handler._greenlet
+        assert greenlets[1] is not handler._greenlet
+        assert read_stream(handler, FCGI_STDOUT, req_id) == data
+        assert read_stream(handler, FCGI_STDOUT, req_id_2) == data_2
+        assert not handler.requests
+
+    def test_drain(self):
+        sock, peer = socket.socketpair()
+        handler = ConnectionHandler(
+            ServerConnection(sock), FCGI_RESPONDER, {}, copy_stdin_to_stdout)
+        greenlet = spawn(handler.run)
+        conn = Connection(peer)
+        data = binary_data()
+        req_id = next_req_id()
+        conn.write_records(make_record(*rec) for rec in (
+            (FCGI_BEGIN_REQUEST, pack_begin_request(
+                FCGI_RESPONDER, FCGI_KEEP_CONN), req_id),
+            (FCGI_PARAMS, pack_env(), req_id),
+            (FCGI_PARAMS, '', req_id),
+            (FCGI_STDIN, data, req_id),
+            (FCGI_STDIN, '', req_id),
+        ))
+        for record in conn:
+            if record.type == FCGI_END_REQUEST:
+                break
+        sleep(0.01)
+        assert not greenlet.ready()
+
+        # idle connection is closed right away despite FCGI_KEEP_CONN
+        handler.drain()
+        greenlet.join(timeout=1)
+        assert greenlet.successful()
+        assert conn.read_record() is None
+        peer.close()
+
+    def test_no_garbage(self):
+        def request_handler(request):
+            copy_stdin_to_stdout(request)
+            if request.environ['PATH_INFO'] == '/fail':
+                raise ValueError('Request handler failed')
+
+        for flags in (0, FCGI_KEEP_CONN):
+            records = []
+            for path in ('/', '/fail'):
+                req_id = next_req_id()
+                records.extend((
+                    (FCGI_BEGIN_REQUEST, pack_begin_request(
+                        FCGI_RESPONDER, flags), req_id),
+                    (FCGI_PARAMS, pack_env(PATH_INFO=path), req_id),
+                    (FCGI_PARAMS, '', req_id),
+                    (FCGI_STDIN, binary_data(), req_id),
+                    (FCGI_STDIN, '', req_id),
+                ))
+            # warm up caches first
+            serve_connection(records, request_handler)
+            # automatic collection would hide cycles created meanwhile
+            gc_enabled = gc.isenabled()
+            gc.disable()
+            # captured log records would keep tracebacks alive
+            logger.disabled = True
+            try:
+                gc.collect()
+                serve_connection(records, request_handler)
+                # finished requests must be freed by refcounting
+                assert gc.collect() == 0
+            finally:
+                logger.disabled = False
+                if gc_enabled:
+                    gc.enable()
+
 
 # Helper functions
 
@@ -199,8 +552,30 @@ def iter_records(records, done=None):
         sleep(0)
 
 
+def serve_connection(records, request_handler):
+    """
+    Send records to ConnectionHandler over socket pair and wait for all
+    requests to end
+    """
+    sock, peer = socket.socketpair()
+    handler = ConnectionHandler(
+        ServerConnection(sock), FCGI_RESPONDER, {}, request_handler)
+    greenlet = spawn(handler.run)
+    conn = Connection(peer)
+    conn.write_records(make_record(*rec) for rec in records)
+    request_ids = set(rec[2] for rec in records)
+    for record in conn:
+        if record.type == FCGI_END_REQUEST:
+            request_ids.discard(record.request_id)
+            if not request_ids:
+                break
+    peer.close()
+    greenlet.join()
+
+
 def run_handler(records, role=FCGI_RESPONDER, request_handler=None,
-                capabilities=None, timeout=None):
+                capabilities=None, timeout=None, stdin_options=None,
+                max_body_size=None):
     conn = mock.MagicMock()
     conn.__iter__.return_value = iter_records(records)
 
@@ -214,7 +589,9 @@ def run_handler(records, role=FCGI_RESPONDER, request_handler=None,
     if request_handler is None:
         request_handler = mock.MagicMock()
 
-    handler = ConnectionHandler(conn, role, capabilities, request_handler)
+    handler = ConnectionHandler(conn, role, capabilities, request_handler,
+                                stdin_options=stdin_options,
+                                max_body_size=max_body_size)
     g = spawn(handler.run)
     g.join(timeout)
 
@@ -222,8 +599,16 @@ def run_handler(records, role=FCGI_RESPONDER, request_handler=None,
 
 
 def read_records(conn, req_id=None):
-    return [args[0] for args, kw in conn.write_record.call_args_list
-            if req_id is None or args[0].request_id == req_id]
+    records = []
+    for name, args, kw in conn.mock_calls:
+        if name == 'write_record':
+            if len(args) > 1:
+                args = (Record(args[0], args[2], args[1]),)
+            records.append(args[0])
+        elif name == 'write_records':
+            records.extend(args[0])
+    return [rec for rec in records
+            if req_id is None or rec.request_id == req_id]
 
 
 def find_rec(handler, rec_type, req_id=FCGI_NULL_REQUEST_ID):
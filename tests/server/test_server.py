@@ -5,6 +5,7 @@ import signal
 import unittest
 import logging
 import errno
+import socket
 import six
 
 
@@ -198,6 +199,42 @@ class ServerTests(unittest.TestCase):
             assert headers.get(b'Status') == b'200 OK', repr(headers)
             assert body == data
 
+    def test_write_queue(self):
+        data = binary_data()
+        requests = []
+        for request_id in (14, 15, 16):
+            requests += [
+                Record(FCGI_BEGIN_REQUEST, pack_begin_request(
+                       FCGI_RESPONDER, 0), request_id),
+                Record(FCGI_PARAMS,
+                       pack_env(REQUEST_METHOD='POST'), request_id),
+                Record(FCGI_PARAMS, '', request_id),
+                Record(FCGI_STDIN, data, request_id),
+                Record(FCGI_STDIN, '', request_id),
+            ]
+        for response in self._handle_requests(
+                (14, 15, 16), requests, write_queue_size=256):
+            assert response.request_status == FCGI_REQUEST_COMPLETE
+            headers, body = response.parse()
+            assert body == data
+
+    def test_stdout_buffer(self):
+        request_id = 17
+        data = binary_data()
+        request = [
+            Record(FCGI_BEGIN_REQUEST, pack_begin_request(
+                   FCGI_RESPONDER, 0), request_id),
+            Record(FCGI_PARAMS, pack_env(REQUEST_METHOD='POST'), request_id),
+            Record(FCGI_PARAMS, '', request_id),
+            Record(FCGI_STDIN, data, request_id),
+            Record(FCGI_STDIN, '', request_id),
+        ]
+        response = self._handle_one_request(
+            request_id, request, stdout_buffer_size=4096)
+        assert response.request_status == FCGI_REQUEST_COMPLETE
+        headers, body = response.parse()
+        assert body == data
+
     def test_failed_request(self):
         error = AssertionError('Mock application failure SIMULATION')
         request_id = 10
@@ -239,7 +276,7 @@ class ServerTests(unittest.TestCase):
 
     @unittest.skipIf(os.name == "nt", "Test not supported on Windows")
     def test_restart_workers(self):
-        from gevent import sleep
+        sleep = self._sleep
 
         with start_wsgi_server(num_workers=4) as server:
             assert server.num_workers == 4
@@ -252,12 +289,266 @@ class ServerTests(unittest.TestCase):
                 os.kill(worker, 0)
             except OSError as e:
                 assert e.errno == errno.ESRCH
-            sleep(5)
+            # replacement is started as soon as worker exits
+            sleep(0.5)
+            assert len(server._workers) == server.num_workers
+            assert worker not in server._workers
+
+    def test_respawn_backoff(self):
+        sleep = self._sleep
+
+        with start_wsgi_server(num_workers=2) as server:
+            # every worker killed from now on has crashed at startup
+            server.startup_period = 60
+            server.respawn_delay = 1
+            worker = server._workers[0]
+            os.kill(worker, signal.SIGKILL)
+            sleep(0.5)
+            # first crash is restarted immediately
             assert len(server._workers) == server.num_workers
+            worker = server._workers[-1]
+            os.kill(worker, signal.SIGKILL)
+            sleep(0.5)
+            # restart of crash looping worker is delayed
+            assert server._crashes == 2
             assert worker not in server._workers
+            assert len(server._workers) == server.num_workers - 1
+            sleep(1)
+            assert len(server._workers) == server.num_workers
+
+    @unittest.skipUnless(hasattr(socket, 'SO_REUSEPORT'),
+                         'SO_REUSEPORT is not supported')
+    def test_reuse_port(self):
+        from gevent import sleep
+
+        for num_workers in (1, 3):
+            with start_wsgi_server(num_workers=num_workers,
+                                   reuse_port=True) as server:
+                # only process that accepts connections listens on socket
+                listening = server.socket.getsockopt(
+                    socket.SOL_SOCKET, socket.SO_ACCEPTCONN)
+                assert bool(listening) == (num_workers == 1)
+                # connections are refused until some worker listens
+                sleep(0.1)
+                for _ in range(10):
+                    with make_connection(server.address) as conn:
+                        self._run_get_values(conn)
+
+        self.assertRaises(ValueError, start_wsgi_server(
+            'socket.{0}'.format(os.getpid()), reuse_port=True).__enter__)
+
+    @unittest.skipUnless(hasattr(socket, 'SCM_RIGHTS'),
+                         'Passing file descriptors is not supported')
+    def test_master_accept(self):
+        from gevent import sleep, spawn
+
+        def pid_app(environ, start_response):
+            if environ['PATH_INFO'] == '/slow':
+                sleep(1)
+            start_response('200 OK', [])
+            return [str(os.getpid()).encode('ascii')]
+
+        address = 'socket.{0}'.format(os.getpid())
+        with start_wsgi_server(address, pid_app, num_workers=3,
+                               master_accept=True) as server:
+            slow = spawn(self._get_pid, address, '/slow')
+            sleep(0.3)
+            # worker busy with slow request does not get new connections
+            pids = [self._get_pid(address, '/') for _ in range(5)]
+            slow_pid = slow.get(timeout=5)
+            assert slow_pid in server._workers
+            assert slow_pid not in pids
+            assert set(pids) <= set(server._workers)
+
+        self.assertRaises(ValueError, start_wsgi_server(
+            master_accept=True, reuse_port=True).__enter__)
+
+    @unittest.skipUnless(hasattr(socket, 'SCM_RIGHTS'),
+                         'Passing file descriptors is not supported')
+    @unittest.skipUnless(os.path.isdir('/proc/self/fd'),
+                         'Test requires /proc file system')
+    def test_truncated_connection_passing(self):
+        from array import array
+        from gevent import socket as gevent_socket, spawn, sleep
+        from gevent_fastcgi.server import FastCGIServer, WorkerLoad
+
+        handled = []
+        server = FastCGIServer(('127.0.0.1', 0), handled.append,
+                               num_workers=2, master_accept=True)
+        master_end, worker_end = gevent_socket.socketpair()
+        server._channel = worker_end
+        server._load = WorkerLoad(1)
+        server._slot = 0
+        try:
+            receiver = spawn(server._receive_connections)
+            # worker expects single descriptor per message
+            conns = [socket.socket() for _ in range(3)]
+            passed = set('socket:[{0}]'.format(os.fstat(conn.fileno()).st_ino)
+                         for conn in conns)
+            master_end.sendmsg([b'\0'], [(
+                socket.SOL_SOCKET, socket.SCM_RIGHTS,
+                array('i', [conn.fileno() for conn in conns]))])
+            for conn in conns:
+                conn.close()
+            master_end.close()
+            receiver.get(timeout=1)
+            assert not handled
+            # received descriptors are closed, gevent does it in next loop
+            # iteration
+            sleep(0.1)
+            open_files = set()
+            for fd in os.listdir('/proc/self/fd'):
+                try:
+                    open_files.add(os.readlink('/proc/self/fd/' + fd))
+                except OSError:
+                    pass
+            assert not open_files & passed
+        finally:
+            worker_end.close()
+            server.close()
+
+    @unittest.skipIf(os.name == "nt", "Test not supported on Windows")
+    def test_preload(self):
+        import gc
+
+        preloaded = []
+        try:
+            with start_wsgi_server(
+                    num_workers=2,
+                    preload=lambda: preloaded.append(os.getpid())) as server:
+                assert preloaded == [os.getpid()]
+                if hasattr(gc, 'freeze'):
+                    assert gc.get_freeze_count()
+                memory = server.worker_memory()
+                assert sorted(memory) == sorted(server._workers)
+                if os.path.exists('/proc/self/smaps'):
+                    for rss, uss in memory.values():
+                        assert 0 < uss <= rss
+        finally:
+            if hasattr(gc, 'unfreeze'):
+                gc.unfreeze()
+
+    @unittest.skipUnless(os.path.exists('/proc/self/stat'),
+                         'Test requires /proc file system')
+    def test_recycle_workers(self):
+        from gevent import get_hub, sleep as app_sleep
+        sleep = self._sleep
+
+        def pid_app(environ, start_response):
+            if environ['PATH_INFO'] == '/slow':
+                # lasts well over a second after worker starts draining
+                app_sleep(4)
+            start_response('200 OK', [])
+            return [str(os.getpid()).encode('ascii')]
+
+        with start_wsgi_server(app=pid_app, num_workers=2, max_age=1,
+                               drain_timeout=10) as server:
+            workers = list(server._workers)
+            # thread is not copied into workers forked meanwhile so they
+            # do not read response instead of the test
+            slow = get_hub().threadpool.spawn(
+                self._get_pid, server.address, '/slow')
+            for _ in range(80):
+                if slow.ready():
+                    break
+                sleep(0.1)
+            # retiring worker completes active request before exiting
+            assert slow.get(block=False) in workers
+            for _ in range(30):
+                if all(map(self._exited, workers)):
+                    break
+                sleep(0.1)
+            else:
+                self.fail('Workers {0} did not exit'.format(workers))
+            active = [pid for pid, state in server._states.items()
+                      if not state.retiring]
+            assert len(active) == server.num_workers
+            assert not set(active) & set(workers)
+
+    @unittest.skipIf(os.name == "nt", "Test not supported on Windows")
+    def test_stop_does_not_drain_workers(self):
+        import time
+        from gevent import get_hub, sleep as app_sleep
+
+        def slow_app(environ, start_response):
+            app_sleep(10)
+            start_response('200 OK', [])
+            return [b'']
+
+        with start_wsgi_server(app=slow_app, num_workers=2,
+                               drain_timeout=10) as server:
+            self._sleep(0.3)
+            get_hub().threadpool.spawn(self._get_pid, server.address, '/')
+            self._sleep(0.3)
+            started = time.time()
+            server.stop()
+            # SIGHUP stops workers at once instead of draining them
+            assert time.time() - started < 1.5
+            assert not server._workers
+
+    def test_worker_stops_on_sighup(self):
+        with start_wsgi_server(num_workers=2) as server:
+            self._sleep(0.3)
+            exited = []
+            worker_exited = server._worker_exited
+
+            def record_status(pid, state, status):
+                exited.append((pid, status))
+                worker_exited(pid, state, status)
+
+            server._worker_exited = record_status
+            worker = server._workers[0]
+            os.kill(worker, signal.SIGHUP)
+            for _ in range(30):
+                self._sleep(0.1)
+                if exited:
+                    break
+            # worker is stopped instead of being terminated by signal
+            assert exited[0][0] == worker
+            assert os.WIFEXITED(exited[0][1])
+            assert os.WEXITSTATUS(exited[0][1]) == 0
 
     # Helpers
 
+    @staticmethod
+    def _sleep(seconds):
+        """
+        Test greenlet is copied into workers forked while it sleeps and
+        must not go on running in them
+        """
+        from gevent import sleep
+        from gevent.event import Event
+
+        pid = os.getpid()
+        sleep(seconds)
+        if os.getpid() != pid:
+            Event().wait()
+
+    @staticmethod
+    def _exited(pid):
+        try:
+            with open('/proc/{0}/stat'.format(pid)) as stat:
+                return stat.read().rsplit(')', 1)[1].split()[0] == 'Z'
+        except IOError:
+            return True
+
+    def _get_pid(self, address, path):
+        request_id = 1
+        response = Response(request_id)
+        with make_connection(address) as conn:
+            conn.write_records([
+                Record(FCGI_BEGIN_REQUEST,
+                       pack_begin_request(FCGI_RESPONDER, 0), request_id),
+                Record(FCGI_PARAMS, pack_env(PATH_INFO=path), request_id),
+                Record(FCGI_PARAMS, '', request_id),
+                Record(FCGI_STDIN, '', request_id),
+            ])
+            for record in conn:
+                if record.type == FCGI_STDOUT:
+                    response.stdout.feed(record.content)
+        headers, body = response.parse()
+        return int(body)
+
     def _run_get_values(self, conn):
         names = (FCGI_MAX_CONNS, FCGI_MAX_REQS, FCGI_MPXS_CONNS)
         get_values_record = Record(FCGI_GET_VALUES,
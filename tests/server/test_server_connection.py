@@ -0,0 +1,90 @@
+from __future__ import absolute_import
+
+import unittest
+
+from gevent import spawn, joinall, sleep
+
+from gevent_fastcgi.const import FCGI_STDOUT
+from gevent_fastcgi.base import Connection, Record
+from gevent_fastcgi.server import ServerConnection
+from ..utils import binary_data, MockSocket
+
+
+class CountingSocket(MockSocket):
+
+    sendmsg_calls = 0
+
+    def sendmsg(self, *args, **kw):
+        self.sendmsg_calls += 1
+        return super(CountingSocket, self).sendmsg(*args, **kw)
+
+
+class ServerConnectionTests(unittest.TestCase):
+
+    def test_write_queue(self):
+        sock = CountingSocket()
+        conn = ServerConnection(sock, write_queue_size=1024 * 1024)
+        records = [Record(FCGI_STDOUT, binary_data(137, 1), request_id)
+                   for request_id in range(1, 14)]
+
+        joinall([spawn(conn.write_record, record) for record in records])
+        conn.flush()
+
+        # records written during same hub iteration are sent at once
+        assert sock.sendmsg_calls == 1
+
+        sock.flip()
+        assert list(Connection(sock)) == records
+
+    def test_write_queue_backpressure(self):
+        sock = MockSocket()
+        conn = ServerConnection(sock, write_queue_size=100)
+        writer = spawn(conn.write_record,
+                       Record(FCGI_STDOUT, binary_data(1000), 1))
+        sleep(0)
+        assert not writer.ready()
+        assert not sock.output
+
+        writer.join(1)
+        assert writer.successful()
+        assert sock.output
+
+    def test_write_queue_error(self):
+        sock = MockSocket()
+        sock.exception = True
+        conn = ServerConnection(sock, write_queue_size=100)
+        with self.assertRaises(IOError):
+            conn.write_record(Record(FCGI_STDOUT, binary_data(1000), 1))
+        with self.assertRaises(IOError):
+            conn.write_record(Record(FCGI_STDOUT, b'', 1))
+
+    def test_close_sends_queued_records(self):
+        sock = MockSocket()
+        conn = ServerConnection(sock, write_queue_size=1024)
+        record = Record(FCGI_STDOUT, binary_data(), 1)
+        conn.write_record(record)
+        assert not sock.output
+        conn.close()
+        assert sock.closed
+
+        sock.flip()
+        assert list(Connection(sock)) == [record]
+
+    def test_write_queue_copies_buffers(self):
+        sock = MockSocket()
+        conn = ServerConnection(sock, write_queue_size=1024)
+        data = binary_data(100)
+        buf = bytearray(data)
+        conn.write_record(FCGI_STDOUT, 1, buf)
+        view = memoryview(data)
+        conn.write_record(Record(FCGI_STDOUT, [memoryview(buf), view], 1))
+        assert not sock.output
+        # read-only views of immutable data are queued as they are
+        assert conn._write_queue[-1].content[1] is view
+        # application is free to reuse its buffer once write returns
+        buf[:] = binary_data(100)
+        conn.flush()
+
+        sock.flip()
+        assert list(Connection(sock)) == [Record(FCGI_STDOUT, data, 1),
+                                          Record(FCGI_STDOUT, data * 2, 1)]
@@ -141,11 +141,13 @@ class WSGIApplication(object):
 
 class TestingConnection(Connection):
 
-    def write_record(self, record):
-        if isinstance(record, six.integer_types + (float,)):
+    def write_record(self, record, request_id=None, content=b''):
+        if request_id is None and isinstance(
+                record, six.integer_types + (float,)):
             sleep(record)
         else:
-            super(TestingConnection, self).write_record(record)
+            super(TestingConnection, self).write_record(
+                record, request_id, content)
 
 
 @contextmanager
@@ -189,6 +191,7 @@ class MockSocket(object):
         self.output = b''
         self.exception = False
         self.closed = False
+        self.max_send = None
 
     def send(self, data, flags=0, timeout=None):
         size = len(data)
@@ -197,6 +200,10 @@ class MockSocket(object):
         #self.some_delay()
         return size
 
+    def sendmsg(self, buffers, ancdata=(), flags=0, address=None):
+        data = b''.join(buffers)
+        return self.send(data[:self.max_send or len(data)], flags)
+
     def sendall(self, data, flags=0):
         self.check_socket()
         self.output += data
@@ -213,6 +220,13 @@ class MockSocket(object):
         self.some_delay()
         return data
 
+    def recv_into(self, buf, nbytes=0):
+        data = self.recv(nbytes or len(buf))
+        size = len(data)
+        if size:
+            buf[:size] = data
+        return size
+
     def close(self):
         self.closed = True
 
@@ -3,10 +3,13 @@ from __future__ import absolute_import
 import sys
 import unittest
 import six
+import mock
+from tempfile import TemporaryFile
 from six.moves import xrange
 
-from gevent_fastcgi.const import FCGI_STDOUT, FCGI_RESPONDER
-from gevent_fastcgi.base import Connection
+from gevent_fastcgi.const import (
+    FCGI_STDOUT, FCGI_STDERR, FCGI_END_REQUEST, FCGI_RESPONDER)
+from gevent_fastcgi.base import Connection, BodyTooLarge
 from gevent_fastcgi.server import Request
 from gevent_fastcgi.wsgi import WSGIRequestHandler, WSGIRefRequestHandler
 from ..utils import text_data, MockSocket, text_data
@@ -151,6 +154,97 @@ class WSGIRequestHandlerTests(WSGIRequestHandlerBase, unittest.TestCase):
 
     handler_class = WSGIRequestHandler
 
+    def test_small_response_single_write(self):
+        data = [b'Hello', b' ', b'World!']
+
+        def app(environ, start_response):
+            start_response('200 OK', [('Content-type', 'text/plain')])
+            return data
+
+        sock = MockSocket()
+        conn = Connection(sock)
+        conn.write_records = mock.Mock(wraps=conn.write_records)
+        request = Request(conn, 1, FCGI_RESPONDER)
+
+        self.handler_class(app)(request)
+
+        assert conn.write_records.call_count == 1
+        assert request.ended
+
+        sock.flip()
+        records = list(conn)
+        assert [record.type for record in records] == [
+            FCGI_STDOUT, FCGI_STDOUT, FCGI_STDERR, FCGI_END_REQUEST]
+        header, body = records[0].content.tobytes().split(b'\r\n\r\n', 1)
+        assert b'\r\nContent-Length: 12' in header
+        assert body == b''.join(data)
+
+    def test_body_too_large(self):
+        def app(environ, start_response):
+            environ['wsgi.input'].read()
+            start_response('200 OK', [('Content-type', 'text/plain')])
+            return [b'OK']
+
+        sock = MockSocket()
+        conn = Connection(sock)
+        request = Request(conn, 1, FCGI_RESPONDER)
+        request.stdin.discard(BodyTooLarge('Too large'))
+
+        self.handler_class(app)(request)
+
+        assert request.ended
+        sock.flip()
+        records = list(conn)
+        assert records[0].type == FCGI_STDOUT
+        assert records[0].content.tobytes().startswith(b'Status: 413 ')
+
+    def test_file_wrapper(self):
+        data = b''.join(text_data(1000).encode('ascii') for _ in range(100))
+
+        with TemporaryFile() as f:
+            f.write(data)
+            f.seek(10)
+
+            def app(environ, start_response):
+                start_response('200 OK', [('Content-type', 'text/plain')])
+                return environ['wsgi.file_wrapper'](f)
+
+            sock = MockSocket()
+            conn = Connection(sock)
+            conn.send_file = mock.Mock(wraps=conn.send_file)
+            request = Request(conn, 1, FCGI_RESPONDER)
+
+            self.handler_class(app)(request)
+
+            assert conn.send_file.call_count == 1
+            assert f.closed
+
+        sock.flip()
+        output = b''.join(bytes(record.content) for record in conn
+                          if record.type == FCGI_STDOUT)
+        header, body = output.split(b'\r\n\r\n', 1)
+        assert ('Content-Length: {0}'.format(len(data) - 10)).encode(
+            'ascii') in header
+        assert body == data[10:]
+
+    def test_file_wrapper_not_regular_file(self):
+        data = [b'Hello', b' ', b'World!']
+
+        def app(environ, start_response):
+            start_response('200 OK', [('Content-type', 'text/plain')])
+            return environ['wsgi.file_wrapper'](six.BytesIO(b''.join(data)))
+
+        sock = MockSocket()
+        conn = Connection(sock)
+        request = Request(conn, 1, FCGI_RESPONDER)
+
+        self.handler_class(app)(request)
+
+        sock.flip()
+        output = b''.join(bytes(record.content) for record in conn
+                          if record.type == FCGI_STDOUT)
+        assert output.endswith(b'\r\n\r\n' + b''.join(data))
+
 
 class WSGIRefRequestHandlerTests(WSGIRequestHandlerBase, unittest.TestCase):
 